@@ -0,0 +1,23 @@
+'''
+    Settings for running a node under gunicorn instead of `flask run`:
+
+        gunicorn --bind 127.0.0.1:5000 "noobcash:create_app()"
+
+    gunicorn picks this file up from the working directory.
+'''
+import os
+
+# * The node lives in module globals of the worker process, so there must be exactly one worker and requests are served by its threads
+workers = 1
+worker_class = 'gthread'
+threads = int(os.getenv('SERVER_THREADS', 32))
+
+# * Peers reuse their connections for broadcasts, so idle ones are kept open for a while
+keepalive = int(os.getenv('SERVER_KEEPALIVE', 75))
+
+# * Bootstrapping and consensus can keep a request busy for a long time, the worker is only restarted if it stops responding altogether
+timeout = int(os.getenv('SERVER_TIMEOUT', 300))
+graceful_timeout = 10
+
+# * The app would only be loaded in the master, the worker must create it so that the node and its threads and processes belong to it
+preload_app = False
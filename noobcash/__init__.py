@@ -18,6 +18,20 @@ load_dotenv('./env/.env')
 CAPACITY = int(os.getenv('CAPACITY'))
 DIFFICULTY = int(os.getenv('DIFFICULTY'))
 NODE_NUM = int(os.getenv('NODE_NUM'))
+MINING_PROCESSES = int(os.getenv('MINING_PROCESSES', os.cpu_count()))
+VERIFICATION_WORKERS = int(os.getenv('VERIFICATION_WORKERS', os.cpu_count()))
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', 32))
+BROADCAST_TIMEOUT = float(os.getenv('BROADCAST_TIMEOUT', 10))
+INGESTION_WORKERS = int(os.getenv('INGESTION_WORKERS', 4))
+INGESTION_QUEUE_SIZE = int(os.getenv('INGESTION_QUEUE_SIZE', 1000))
+TRANSACTION_BATCH_DELAY = float(os.getenv('TRANSACTION_BATCH_DELAY', 0.005))
+TRANSACTION_BATCH_SIZE = int(os.getenv('TRANSACTION_BATCH_SIZE', 100))
+WIRE_FORMAT = os.getenv('WIRE_FORMAT', 'binary')
+MEMPOOL_RETRY_INTERVAL = float(os.getenv('MEMPOOL_RETRY_INTERVAL', 10))
+MEMPOOL_MAX_RETRY_INTERVAL = float(os.getenv('MEMPOOL_MAX_RETRY_INTERVAL', 160))
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+LOCK_PROFILING = os.getenv('LOCK_PROFILING', 'false').lower() in ('1', 'true', 'yes')
+LOCK_WATCHDOG_THRESHOLD = float(os.getenv('LOCK_WATCHDOG_THRESHOLD', 5))
 
 current_node: Node = None
 master_lock: Lock = Lock()
@@ -1,26 +1,41 @@
-from threading import Thread
 from flask import Blueprint, request
 import noobcash
-import requests
+from noobcash import broadcast, ingestion, wire
 
 from noobcash.block import Block
+from noobcash.exceptions import InsufficientFundsException, NegativeAmountException
 
 bp = Blueprint('block', __name__, url_prefix='/block')
 
 @bp.route('/receive', methods=['POST'])
 def receive():
-    received_block = Block.from_dictionary(dict(request.get_json()))    
+    try:
+        received_block = read_block()
+    except ValueError as e:
+        return str(e), 400
     
-    handling_thread = Thread(target=noobcash.current_node.add_block_to_blockchain, args=[received_block])
-    handling_thread.start()
+    is_queued = ingestion.get_queue('blocks').submit(noobcash.current_node.add_block_to_blockchain, received_block)
+    
+    if not is_queued:
+        return 'Too many pending blocks', 503
         
     return '', 200
 
-def broadcast_block(block: Block, ring):
-    block = block.to_dict()
+def read_block():
+    '''
+        Parses the block in the body of the request, in whichever format it was sent. Raises ValueError if it is malformed.
+    '''
+    if request.mimetype == wire.CONTENT_TYPE:
+        return wire.loads(wire.BLOCK, request.get_data(), noobcash.current_node.ring)
     
-    for key, node_info in ring.items():
-        if key != noobcash.current_node.id:
-            r = requests.post(f"http://{node_info['ip']}:{node_info['port']}/block/receive", json=block)
-            
-    # print(f'{noobcash.current_node.id}: finished broadcasting')
+    try:
+        return Block.from_dictionary(dict(request.get_json()))
+    except (KeyError, TypeError, InsufficientFundsException, NegativeAmountException) as e:
+        raise ValueError(f'Malformed block: {e}') from e
+
+def broadcast_block(block: Block, ring):
+    if noobcash.WIRE_FORMAT == 'binary':
+        data = wire.dumps(wire.BLOCK, block, noobcash.current_node.ring_index)
+        broadcast.broadcast(ring, '/block/receive', data=data, headers={'Content-Type': wire.CONTENT_TYPE})
+    else:
+        broadcast.broadcast(ring, '/block/receive', json=block.to_dict())
@@ -3,6 +3,8 @@ import requests
 import os
 from noobcash import blockchain
 import noobcash
+from noobcash import broadcast, wire
+from noobcash.block import Block
 from noobcash.blockchain import Blockchain
 from noobcash.transaction import Transaction
 
@@ -10,22 +12,157 @@ from flask import Blueprint, request
 
 bp = Blueprint('blockchain', __name__, url_prefix='/blockchain')
 
-@bp.route('/get', methods=['POST'])
-def send_blockchain():    
-    hash_list = dict(request.get_json())['hash_list']
+# * Most headers sent in one response
+HEADERS_PAGE_SIZE = 500
+
+# * Most blocks fetched in one request
+BLOCKS_PAGE_SIZE = 50
+
+@bp.route('/locate', methods=['POST'])
+def locate():
+    '''
+        Finds the last block we have in common with the locator of the requesting node and returns the headers of our blocks after it.
+    '''
+    try:
+        locator = read_hashes('locator')
+    except ValueError as e:
+        return str(e), 400
     
-    partial_chain, last_consensual_hash = noobcash.current_node.get_partial_chain(hash_list)
-            
-    return {'partial_chain': partial_chain.to_dict(), 'last_consensual_hash': last_consensual_hash}, 200
+    blockchain = noobcash.current_node.blockchain
+    fork_height = blockchain.locate(locator)
+    
+    if fork_height < 0:
+        return {'fork_hash': None, 'length': blockchain.get_length(), 'headers': []}, 200
+    
+    headers = [block.header_to_dict() for block in blockchain.chain[fork_height + 1:fork_height + 1 + HEADERS_PAGE_SIZE]]
+    
+    return {'fork_hash': blockchain.chain[fork_height].hash, 'length': blockchain.get_length(), 'headers': headers}, 200
 
-def get_blockchain_from_node(node_ip, node_port):
-    # * Send my hashes in order x2 that the other node knows to send me only the blocks after our first disagreement
+@bp.route('/headers', methods=['POST'])
+def send_headers():
+    '''
+        Returns the next page of headers after the given block, for forks deeper than what fits in a single response.
+    '''
+    try:
+        from_hash = read_hash('from_hash')
+    except ValueError as e:
+        return str(e), 400
+    
+    blockchain = noobcash.current_node.blockchain
+    height = blockchain.get_height(from_hash)
+    
+    if height is None:
+        return 'Unknown block', 404
+    
+    headers = [block.header_to_dict() for block in blockchain.chain[height + 1:height + 1 + HEADERS_PAGE_SIZE]]
+    
+    return {'headers': headers}, 200
+
+@bp.route('/blocks', methods=['POST'])
+def send_blocks():
+    '''
+        Returns the blocks with the given hashes, in the given order.
+    '''
+    try:
+        hashes = read_hashes('hashes')[:BLOCKS_PAGE_SIZE]
+    except ValueError as e:
+        return str(e), 400
+    
+    blockchain = noobcash.current_node.blockchain
+    heights = [blockchain.get_height(block_hash) for block_hash in hashes]
+    
+    if None in heights:
+        return 'Unknown block', 404
     
-    hash_list = [block.hash for block in noobcash.current_node.blockchain.chain]
+    blocks = Blockchain([blockchain.chain[height] for height in heights])
     
-    r = requests.post(f"http://{node_ip}:{node_port}/blockchain/get", json={'hash_list': hash_list})
+    if request.accept_mimetypes.best_match(['application/json', wire.CONTENT_TYPE]) == wire.CONTENT_TYPE:
+        return wire.dumps(wire.BLOCKCHAIN, blocks, noobcash.current_node.ring_index), 200, {'Content-Type': wire.CONTENT_TYPE}
+    
+    return {'blocks': blocks.to_dict()}, 200
+
+def read_hash(name):
+    '''
+        Returns the block hash in the given field of the JSON body of the request. Raises ValueError if the body doesn't have one there.
+    '''
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get(name), str):
+        raise ValueError(f'Malformed request: {name} must be a block hash')
+    
+    return data[name]
+
+def read_hashes(name):
+    '''
+        Returns the list of block hashes in the given field of the JSON body of the request. Raises ValueError if the body doesn't have one there.
+    '''
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get(name), list) or not all(isinstance(block_hash, str) for block_hash in data[name]):
+        raise ValueError(f'Malformed request: {name} must be a list of block hashes')
+    
+    return data[name]
+
+def get_headers_from_node(node_info, min_length=0):
+    '''
+        Returns the hash of the last block we have in common with the node's chain and the headers of the node's blocks after it.
+        If the node's chain is not longer than min_length, or the node's answers don't add up, returns None, None.
+    '''
+    blockchain = noobcash.current_node.blockchain
+    
+    # * Find the fork point from a few exponentially spaced hashes instead of sending all of them
+    response = broadcast.post(node_info, '/blockchain/locate', json={'locator': blockchain.get_locator()}).json()
+    
+    fork_hash = response['fork_hash']
+    fork_height = blockchain.get_height(fork_hash) if fork_hash is not None else None
+    if fork_height is None or response['length'] <= min_length:
+        return None, None
+    
+    # * Then get the headers of the blocks after it, page by page
+    headers = response['headers']
+    while headers and fork_height + 1 + len(headers) < response['length']:
+        page = broadcast.post(node_info, '/blockchain/headers', json={'from_hash': headers[-1]['hash']}).json()['headers']
+        if not page:
+            break
+        headers.extend(page)
+        
+    # * The locator gets sparser further back, so the node may have started from before the actual fork point. Skip the blocks we already have
+    while headers and blockchain.get_height(headers[0]['hash']) == fork_height + 1:
+        fork_height += 1
+        fork_hash = headers.pop(0)['hash']
+        
+    # * Check that the headers make a chain on top of ours with proper proof of work before downloading any block
+    previous_hash = fork_hash
+    for header in headers:
+        if header['previous_hash'] != previous_hash or not Block.from_header(header).validate_hash():
+            return None, None
+        previous_hash = header['hash']
+        
+    if fork_height + 1 + len(headers) <= min_length:
+        return None, None
+    
+    return fork_hash, headers
+
+def get_blocks_from_node(node_info, headers):
+    '''
+        Fetches the blocks of the given headers from the node, page by page. Returns None if the node doesn't have them all anymore.
+    '''
+    accept = wire.CONTENT_TYPE if noobcash.WIRE_FORMAT == 'binary' else 'application/json'
+    partial_chain = Blockchain()
+    for start in range(0, len(headers), BLOCKS_PAGE_SIZE):
+        hashes = [header['hash'] for header in headers[start:start + BLOCKS_PAGE_SIZE]]
+        r = broadcast.post(node_info, '/blockchain/blocks', json={'hashes': hashes}, headers={'Accept': accept})
+        
+        if r.status_code != 200:
+            return None
+        
+        if r.headers.get('Content-Type') == wire.CONTENT_TYPE:
+            blocks = wire.loads(wire.BLOCKCHAIN, r.content, noobcash.current_node.ring)
+        else:
+            blocks = Blockchain.from_dictionary(r.json()['blocks'])
+            
+        if [block.hash for block in blocks.chain] != hashes:
+            return None
+        
+        for block in blocks.chain:
+            partial_chain.add_block(block)
     
-    response = r.json()
-    partial_chain = Blockchain.from_dictionary(response['partial_chain'])
-    last_consensual_hash = response['last_consensual_hash']
-    return partial_chain, last_consensual_hash
\ No newline at end of file
+    return partial_chain
@@ -10,6 +10,7 @@ from flask import (
 
 from Crypto.Hash import SHA256
 import noobcash
+from noobcash import broadcast
 from noobcash.block import Block
 from noobcash.mempool import broadcast_mempool
 from noobcash.node import Node
@@ -38,6 +39,7 @@ def register():
     node_id = str(len(noobcash.current_node.ring))
 
     noobcash.current_node.ring[node_id] = { 'ip': ip_address, 'port': port, 'public_key': public_key }
+    noobcash.current_node.update_ring_index()
             
     send_id_to_node(ip_address, port, node_id)
     # print('node')
@@ -76,15 +78,15 @@ def reset():
 
 def send_initial_utxo(node_id, initial_utxo: TransactionOutput):
     node_info = noobcash.current_node.ring[node_id]
-    r = requests.post(f"http://{node_info['ip']}:{node_info['port']}/transaction/get_initial_utxo", json=initial_utxo.to_dict())
+    r = broadcast.post(node_info, '/transaction/get_initial_utxo', json=initial_utxo.to_dict())
 
 def send_id_to_node(node_address, node_port, node_id):
-    r = requests.post(f"http://{node_address}:{node_port}/id/post", data={'node_id': node_id})
+    r = broadcast.post({'ip': node_address, 'port': node_port}, '/id/post', data={'node_id': node_id})
 
 def broadcast_initial_info(ring, genesis_block, shadow_log):
     ring_dict = ring
     genesis_block_dict = genesis_block.to_dict()
-    shadow_log_dict = {key: state.to_dict() for key, state in shadow_log.items()}
+    shadow_log_dict = shadow_log.to_dict()
     
     data = {
             'ring': ring_dict,
@@ -92,6 +94,4 @@ def broadcast_initial_info(ring, genesis_block, shadow_log):
             'shadow_log': shadow_log_dict 
             }
     
-    for key, node_info in ring.items():
-        if key != noobcash.current_node.id:
-            r = requests.post(f"http://{node_info['ip']}:{node_info['port']}/initial_data", json=data)
\ No newline at end of file
+    broadcast.broadcast(ring, '/initial_data', json=data)
\ No newline at end of file
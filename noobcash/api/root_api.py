@@ -11,9 +11,10 @@ import noobcash
 import requests
 from Crypto.Hash import SHA256
 from flask import Blueprint, request
+from noobcash import locks, metrics, miner
 from noobcash.block import Block
 from noobcash.node import Node
-from noobcash.state import State
+from noobcash.shadow_log import ShadowLog
 from noobcash.transaction import Transaction
 from noobcash.transaction_input import TransactionInput
 from noobcash.transaction_output import TransactionOutput
@@ -68,35 +69,60 @@ def create_node():
 
 @bp.route('/info', methods=['GET'])
 def info():
-    noobcash.current_node.master_state_lock.acquire()
-    active_state = noobcash.current_node.active_blocks_log[noobcash.current_node.active_block.uuid] if noobcash.current_node.active_block is not None\
-                else noobcash.current_node.current_state
+    snapshot = noobcash.current_node.snapshot
+    
+    # * The blocks being filled and mined change with every transaction, so they are not in the snapshot. Only forking the active state and
+    # * copying the blocks is done under the block lock, which is cheap, and they are serialized after it is released
+    noobcash.current_node.block_lock.acquire()
+    active_block = noobcash.current_node.active_block
+    active_state = noobcash.current_node.active_blocks_log[active_block.uuid].fork() if active_block is not None else snapshot.current_state
+    active_block = active_block.copy() if active_block is not None else None
+    mining_block = noobcash.current_node.mining_block.copy() if noobcash.current_node.mining_block is not None else None
+    sealed_blocks = len(noobcash.current_node.sealed_blocks)
+    noobcash.current_node.block_lock.release()
+    
+    active_utxos = active_state.utxos[noobcash.current_node.id].values()
     
     info = {
         'id': noobcash.current_node.id,
-        'balance': noobcash.current_node.wallet.balance(),
-        'wallet_utxos': [utxo.to_dict() for utxo in noobcash.current_node.wallet.UTXOs],
-        'wallet_stxos': list(noobcash.current_node.wallet.STXOs),
-        'active_balance': sum([utxo for _, utxo in active_state.utxos[noobcash.current_node.id].items()]),
-        'active_utxos': [utxo.to_dict() for _, utxo in active_state.utxos[noobcash.current_node.id].items()],
-        'active_block': noobcash.current_node.active_block.to_dict() if noobcash.current_node.active_block is not None else {},
-        'mining_block': noobcash.current_node.mining_block.to_dict() if noobcash.current_node.mining_block is not None else {},
-        'ring': noobcash.current_node.ring,
-        'blockchain': noobcash.current_node.blockchain.to_dict(),
-        'current_state': noobcash.current_node.current_state.to_dict(),
+        'balance': snapshot.balance,
+        'wallet_utxos': [utxo.to_dict() for utxo in snapshot.wallet_utxos],
+        'wallet_stxos': list(snapshot.wallet_stxos),
+        'active_balance': sum(active_utxos),
+        'active_utxos': [utxo.to_dict() for utxo in active_utxos],
+        'active_block': active_block.to_dict() if active_block is not None else {},
+        'mining_block': mining_block.to_dict() if mining_block is not None else {},
+        'sealed_blocks': sealed_blocks,
+        'mining': miner.stats.to_dict(),
         'active_state': active_state.to_dict(),
+        'ring': noobcash.current_node.ring,
+        'blockchain': {'chain': [block.to_dict() for block in snapshot.chain], 'last_hash': snapshot.chain[-1].hash},
+        'current_state': snapshot.current_state.to_dict(),
         'mempool': [transaction.to_dict() for _, transaction in noobcash.current_node.mempool.items()],
     }
-    noobcash.current_node.master_state_lock.release()
     
     return info, 200
 
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    if not noobcash.METRICS_ENABLED:
+        return 'Metrics are disabled, set METRICS_ENABLED to record them', 404
+    
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@bp.route('/locks', methods=['GET'])
+def get_locks():
+    if not noobcash.LOCK_PROFILING:
+        return 'Lock profiling is disabled, set LOCK_PROFILING to enable it', 404
+    
+    return locks.dump(), 200
+
 @bp.route('/balance', methods=['GET'])
 def balance():
-    noobcash.current_node.master_state_lock.acquire()
-    current_balance = sum([utxo for _, utxo in noobcash.current_node.current_state.utxos[noobcash.current_node.id].items()])
-    remaining_funds = noobcash.current_node.wallet.balance()
-    noobcash.current_node.master_state_lock.release()
+    # * Served from the last published snapshot, without waiting for any lock
+    snapshot = noobcash.current_node.snapshot
+    current_balance = sum([utxo for _, utxo in snapshot.current_state.utxos[noobcash.current_node.id].items()])
+    remaining_funds = snapshot.balance
         
     pending = current_balance - remaining_funds
     
@@ -107,11 +133,9 @@ def balance():
 
 @bp.route('/view', methods=['GET'])
 def view():
-    noobcash.current_node.master_state_lock.acquire()
-    last_block = noobcash.current_node.blockchain.chain[-1]
+    last_block = noobcash.current_node.snapshot.chain[-1]
     
     data = [transaction.to_dict() for transaction in last_block.list_of_transactions]
-    noobcash.current_node.master_state_lock.release()
     
     return {'data': data}, 200
 
@@ -122,14 +146,16 @@ def initial_data():
     
     ring = data['ring']
     genesis_block = Block.from_dictionary(data['genesis_block'])
-    shadow_log = {key: State.from_dictionary(state) for key, state in data['shadow_log'].items()}
+    shadow_log = ShadowLog.from_dictionary(data['shadow_log'])
 
     noobcash.current_node.ring = ring
+    noobcash.current_node.update_ring_index()
     noobcash.current_node.blockchain.add_block(genesis_block)
     noobcash.current_node.shadow_log = shadow_log
     noobcash.current_node.current_state = shadow_log[noobcash.current_node.blockchain.last_hash]
     for _, utxo in noobcash.current_node.current_state.utxos[noobcash.current_node.id].items():
         noobcash.current_node.wallet.add_transaction_output(utxo)
+    noobcash.current_node.publish_snapshot()
         
     mempool_thread = threading.Thread(target=broadcast_mempool)
     mempool_thread.start()
@@ -11,18 +11,38 @@ from flask import (
 
 import noobcash
 import noobcash.transaction
+from noobcash import broadcast, ingestion, wire
 from noobcash.transaction_output import TransactionOutput
 
 bp = Blueprint('transaction', __name__, url_prefix='/transaction')
 
 @bp.route('/receive', methods=['POST'])
 def receive():
-    received_transaction = Transaction.from_dictionary(dict(request.get_json()))
+    try:
+        received_transaction = read_transactions(single=True)[0]
+    except ValueError as e:
+        return str(e), 400
     
     # print(f'Received transaction {received_transaction.transaction_id} from {noobcash.current_node.get_node_id_from_address(received_transaction.sender_address)}')
     
-    handling_thread = threading.Thread(target=noobcash.current_node.validate_and_add_transaction_to_block, args=[received_transaction])
-    handling_thread.start()
+    is_queued = ingestion.get_queue('transactions').submit(noobcash.current_node.validate_and_add_transaction_to_block, received_transaction)
+    
+    if not is_queued:
+        return 'Too many pending transactions', 503
+    
+    return '', 200
+
+@bp.route('/receive_batch', methods=['POST'])
+def receive_batch():
+    try:
+        received_transactions = read_transactions()
+    except ValueError as e:
+        return str(e), 400
+    
+    is_queued = ingestion.get_queue('transactions').submit(noobcash.current_node.validate_and_add_transactions_to_block, received_transactions)
+    
+    if not is_queued:
+        return 'Too many pending transactions', 503
     
     return '', 200
 
@@ -51,15 +71,65 @@ def create():
 @bp.route('/get_initial_utxo', methods=['POST'])
 def get_initial_utxo():
     initial_utxo = TransactionOutput.from_dictionary(dict(request.get_json()))
-    noobcash.current_node.wallet.add_transaction_output(initial_utxo)
+    noobcash.current_node.add_initial_utxo(initial_utxo)
     
     return '', 200
     
 def broadcast_transaction(transaction: Transaction):
-    for key, node_info in noobcash.current_node.ring.items():
-        if key != noobcash.current_node.id:
-            # print(f"Sending transaction {transaction.transaction_id} to {node_info['ip']}:{node_info['port']}")
-            r = requests.post(f"http://{node_info['ip']}:{node_info['port']}/transaction/receive", json=transaction.to_dict())
-            # print(f'Transaction {transaction.transaction_id} successfully sent')
-            
-    # print(f'All nodes have received transaction {transaction.transaction_id}')
\ No newline at end of file
+    # * Transactions are not sent right away but gathered for a few milliseconds and sent together
+    get_coalescer().add(transaction)
+    
+def broadcast_transactions(transactions: list[Transaction]):
+    responses = broadcast.broadcast(noobcash.current_node.ring, '/transaction/receive_batch', **encode_transactions(transactions))
+    
+    # * Peers that accepted the transactions won't be sent them again by the mempool
+    for node_id, response in responses.items():
+        if response is not None and response.status_code == 200:
+            for transaction in transactions:
+                noobcash.current_node.mempool.acknowledge(transaction.transaction_id, node_id)
+    
+def post_transactions(node_info, transactions: list[Transaction]):
+    return broadcast.post(node_info, '/transaction/receive_batch', **encode_transactions(transactions))
+    
+def encode_transactions(transactions: list[Transaction]):
+    '''
+        Returns the body of a batch of transactions as keyword arguments for requests.
+    '''
+    if noobcash.WIRE_FORMAT == 'binary':
+        data = wire.dumps(wire.TRANSACTIONS, transactions, noobcash.current_node.ring_index)
+        return {'data': data, 'headers': {'Content-Type': wire.CONTENT_TYPE}}
+    
+    return {'json': {'transactions': [transaction.to_dict() for transaction in transactions]}}
+        
+def read_transactions(single=False):
+    '''
+        Parses the transactions in the body of the request, in whichever format they were sent. Raises ValueError if they are malformed,
+        or if a single transaction was expected and there isn't exactly one.
+    '''
+    if request.mimetype == wire.CONTENT_TYPE:
+        transactions = wire.loads(wire.TRANSACTIONS, request.get_data(), noobcash.current_node.ring)
+    else:
+        try:
+            if single:
+                transactions = [Transaction.from_dictionary(dict(request.get_json()))]
+            else:
+                transactions = [Transaction.from_dictionary(transaction_dict) for transaction_dict in request.get_json()['transactions']]
+        except (KeyError, TypeError, InsufficientFundsException, NegativeAmountException) as e:
+            raise ValueError(f'Malformed transaction: {e}') from e
+    
+    if single and len(transactions) != 1:
+        raise ValueError(f'Expected one transaction, got {len(transactions)}')
+    
+    return transactions
+
+coalescer: broadcast.Coalescer | None = None
+coalescer_lock = threading.Lock()
+
+def get_coalescer():
+    global coalescer
+    
+    with coalescer_lock:
+        if coalescer is None:
+            coalescer = broadcast.Coalescer(broadcast_transactions, noobcash.TRANSACTION_BATCH_DELAY, noobcash.TRANSACTION_BATCH_SIZE)
+        
+        return coalescer
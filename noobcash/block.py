@@ -1,15 +1,17 @@
 
 import base64
+import hashlib
 from datetime import datetime
 from uuid import uuid4
 
-from Crypto.Hash import SHA256
-
 import noobcash
+from noobcash import miner
 from noobcash.transaction import Transaction
 
 
 class Block:
+    __slots__ = ('previous_hash', 'timestamp', 'uuid', 'hash', 'nonce', 'failed', 'cancellation', 'list_of_transactions', 'capacity', 'difficulty')
+    
     def __init__(self, previous_hash, timestamp = None, my_hash = None, nonce = None, list_of_transactions = None):
         self.previous_hash = previous_hash
         self.timestamp = str(datetime.now()) if timestamp is None else timestamp
@@ -17,6 +19,7 @@ class Block:
         self.hash = my_hash
         self.nonce = 0 if nonce is None else nonce
         self.failed = False
+        self.cancellation: miner.CancellationToken | None = None
         self.list_of_transactions: list[Transaction] = [] if list_of_transactions is None else list_of_transactions
         self.capacity = noobcash.CAPACITY
         self.difficulty = noobcash.DIFFICULTY
@@ -36,6 +39,21 @@ class Block:
             'list_of_transactions': [transaction.to_dict() for transaction in self.list_of_transactions],
         }
         
+    def header_to_dict(self):
+        '''
+            Everything but the transactions, which is enough to follow the chain and check the proof of work before fetching the whole block.
+        '''
+        return {
+            'previous_hash': self.previous_hash,
+            'timestamp': self.timestamp,
+            'hash': self.hash,
+            'nonce': self.nonce,
+        }
+        
+    @classmethod
+    def from_header(cls, dictionary):
+        return cls(dictionary['previous_hash'], dictionary['timestamp'], dictionary['hash'], dictionary['nonce'])
+        
     @classmethod
     def from_dictionary(cls, dictionary):
         previous_hash = dictionary['previous_hash']
@@ -46,20 +64,32 @@ class Block:
         
         return cls(previous_hash, timestamp, my_hash, nonce, list_of_transactions)
     
+    def copy(self):
+        '''
+            Returns a copy of the block that doesn't change when the block does, like when transactions are added to it or it is mined.
+        '''
+        block = Block(self.previous_hash, self.timestamp, self.hash, self.nonce, list(self.list_of_transactions))
+        block.failed = self.failed
+        
+        return block
+    
     def compute_hash(self):
-        my_hash = SHA256.new()
-        my_hash.update(base64.b64decode(self.previous_hash))
-        my_hash.update(self.timestamp.encode('utf-8'))
+        # * Hashed exactly like the miner hashes every nonce it tries
+        return miner.compute_digest(hashlib.sha256(self.hash_header()), self.nonce)
+    
+    def hash_header(self):
+        '''
+            Everything that goes into the block hash except the nonce, so that miners only need to append the nonce to it.
+        '''
+        header = base64.b64decode(self.previous_hash) + self.timestamp.encode('utf-8')
         
         # Guarantees that if hash is equal then the blocks where created with the exact same constructor call
-        my_hash.update(str(id(self)).encode('utf-8'))
+        header += str(id(self)).encode('utf-8')
         
         for transaction in self.list_of_transactions:
-            my_hash.update(base64.b64decode(transaction.transaction_id))
+            header += base64.b64decode(transaction.transaction_id)
             
-        my_hash.update(bytes(self.nonce))
-        
-        return my_hash.digest()
+        return header
     
     def get_transaction(self, transaction_id):
         for transaction in self.list_of_transactions:
@@ -75,27 +105,38 @@ class Block:
             
         return False
     
-    def mine(self): 
-        while not self.failed:
-            self.hash = self.compute_hash()
-            is_hash_valid = self.validate_hash(self.hash)
-            if is_hash_valid is True:
-                break
-            self.nonce += 1
+    def mine(self):
+        # * The search stops as soon as a valid hash is found or the block is cancelled by another thread
+        self.cancellation = miner.CancellationToken()
+        if self.failed:
+            self.cancellation.cancel()
+            
+        result = miner.search(self.hash_header(), self.difficulty, self.cancellation)
+        self.cancellation = None
+        
+        if result is not None:
+            self.nonce, my_hash = result
+        else:
+            my_hash = self.compute_hash()
             
-        self.hash = base64.b64encode(self.hash).decode('utf-8')
+        self.hash = base64.b64encode(my_hash).decode('utf-8')
         
         return self
 
+    def cancel(self):
+        '''
+            Marks the block as failed and stops mining it if it is being mined. Safe to call from any thread.
+        '''
+        self.failed = True
+        
+        cancellation = self.cancellation
+        if cancellation is not None:
+            cancellation.cancel()
+
     def validate_hash(self, tmp_hash=None):
         hash_bytearr = tmp_hash if tmp_hash is not None else base64.b64decode(self.hash)
         
-        # * Start from third place to skip 0b1 which is the pattern with which all python binaries print
-        hash_bin_repr = ''.join([str(bin(b))[3:] for b in hash_bytearr])
-        
-        # print(f"{noobcash.current_node.id}: {hash_bin_repr[:self.difficulty]} (want {'0' * self.difficulty==hash_bin_repr[:self.difficulty]})")
-        
-        return '0' * self.difficulty == hash_bin_repr[:self.difficulty]
+        return miner.meets_difficulty(hash_bytearr, self.difficulty)
 
     def add_transaction(self, transaction: Transaction):
         # add a transaction to the block            
@@ -2,27 +2,88 @@ import noobcash
 from noobcash.block import Block
 from noobcash.state import State
 
+# * How many of the last blocks are in a locator one by one before the hashes start getting further apart
+LOCATOR_DENSE_BLOCKS = 10
+
 class Blockchain:
     def __init__(self, chain=None, last_hash=None):
-        self.chain: list[Block] = [] if chain is None else chain
+        self.chain: list[Block] = []
         self.last_hash = last_hash
         
+        # * Indexes kept in sync by add_block so that looking up a block or a transaction doesn't need to scan the chain
+        self.heights: dict[str, int] = {}
+        self.transactions: dict[str, tuple[Block, int]] = {}
+        
+        for block in [] if chain is None else chain:
+            self.add_block(block)
+        if last_hash is not None:
+            self.last_hash = last_hash
         
     def is_transaction_spent(self, transaction_id):
-        has_transaction = False
-        for block in self.chain:
-            has_transaction = block.has_transaction(transaction_id=transaction_id)
-            if has_transaction is True:
-                break
-            
-        return has_transaction
+        return transaction_id in self.transactions
+    
+    def find_transaction(self, transaction_id):
+        '''
+            Returns the block that has the given transaction and its position in the block, or None if it's not in the chain.
+        '''
+        return self.transactions.get(transaction_id)
+    
+    def get_height(self, block_hash):
+        '''
+            Returns the position of the block with the given hash in the chain, or None if it's not in the chain.
+        '''
+        return self.heights.get(block_hash)
+    
+    def __contains__(self, block_hash):
+        return block_hash in self.heights
     
     def add_block(self, block: Block):
+        self.heights[block.hash] = len(self.chain)
+        for position, transaction in enumerate(block.list_of_transactions):
+            self.transactions[transaction.transaction_id] = (block, position)
+        
         self.chain.append(block)
         self.last_hash = block.hash
         
         return self
     
+    def up_to(self, block_hash):
+        '''
+            Returns a new blockchain with our blocks up to and including the one with the given hash.
+        '''
+        return Blockchain(self.chain[:self.heights[block_hash] + 1], block_hash)
+    
+    def get_locator(self):
+        '''
+            Returns the hashes of our blocks from the last one back to the first one, one by one for the last few and then exponentially further apart.
+            This way a peer can find the last block we have in common from a handful of hashes, however long the chain is.
+        '''
+        locator = []
+        height = len(self.chain) - 1
+        step = 1
+        while height > 0:
+            locator.append(self.chain[height].hash)
+            if len(locator) >= LOCATOR_DENSE_BLOCKS:
+                step *= 2
+            height -= step
+            
+        if self.chain:
+            locator.append(self.chain[0].hash)
+            
+        return locator
+    
+    def locate(self, locator):
+        '''
+            Returns the height of the first block of the locator that is in our chain, which is the last block we have in common with the chain it came from,
+            or -1 if we don't even share the first block.
+        '''
+        for block_hash in locator:
+            height = self.heights.get(block_hash)
+            if height is not None:
+                return height
+            
+        return -1
+    
     def get_length(self):
         return len(self.chain)
     
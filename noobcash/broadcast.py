@@ -0,0 +1,130 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Lock, Thread
+from time import monotonic
+import traceback
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import noobcash
+
+# * Keep-alive session per peer, so that we don't open a new connection for every message
+sessions: dict[tuple[str, str], requests.Session] = {}
+sessions_lock = Lock()
+
+# * Every message to a peer is sent from this pool so that a broadcast waits for the slowest peer instead of for all of them one after the other
+pool: ThreadPoolExecutor | None = None
+pool_lock = Lock()
+
+# * Messages that must reach the peers in the order they were produced (our mined blocks) are sent from this single thread, so whoever
+# * produces them doesn't wait for the slowest peer
+ordered_pool: ThreadPoolExecutor | None = None
+
+def get_pool():
+    global pool
+
+    with pool_lock:
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=noobcash.BROADCAST_WORKERS)
+
+        return pool
+
+def send_in_order(function, *args):
+    '''
+        Runs function(*args) in the background, after everything sent in order before it has been sent.
+    '''
+    global ordered_pool
+
+    with pool_lock:
+        if ordered_pool is None:
+            ordered_pool = ThreadPoolExecutor(max_workers=1)
+
+    ordered_pool.submit(_run_logging_errors, function, *args)
+
+def _run_logging_errors(function, *args):
+    # * Nobody waits for the result, so an error would go unnoticed otherwise
+    try:
+        function(*args)
+    except Exception:
+        traceback.print_exc()
+
+def get_session(node_info):
+    key = (node_info['ip'], node_info['port'])
+
+    with sessions_lock:
+        if key not in sessions:
+            session = requests.Session()
+            # * Several broadcasts to the same peer can be in flight at the same time, each needs its own connection
+            session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=noobcash.BROADCAST_WORKERS))
+            sessions[key] = session
+
+        return sessions[key]
+
+def post(node_info, path, timeout=None, **kwargs):
+    '''
+        Posts to a single node through its keep-alive session. Raises like requests.post does if the node can't be reached in time.
+    '''
+    timeout = noobcash.BROADCAST_TIMEOUT if timeout is None else timeout
+
+    return get_session(node_info).post(f"http://{node_info['ip']}:{node_info['port']}{path}", timeout=timeout, **kwargs)
+
+def broadcast(ring, path, timeout=None, **kwargs):
+    '''
+        Posts the same message to every node in the ring except ourselves, all at once.
+        Returns the response of every node by node id, or None for the nodes that failed or didn't answer in time.
+    '''
+    futures = {}
+    for key, node_info in ring.items():
+        if key != noobcash.current_node.id:
+            futures[key] = get_pool().submit(post, node_info, path, timeout, **kwargs)
+
+    responses = {}
+    for key, future in futures.items():
+        try:
+            responses[key] = future.result()
+        except requests.RequestException:
+            responses[key] = None
+
+    return responses
+
+class Coalescer:
+    '''
+        Collects items for up to `delay` seconds after the first one arrives, or until there are `max_items` of them,
+        and hands them all together to `flush` from a background thread.
+    '''
+    def __init__(self, flush, delay, max_items):
+        self.flush = flush
+        self.delay = delay
+        self.max_items = max_items
+
+        self.items = []
+        self.condition = Condition()
+        self.thread: Thread | None = None
+
+    def add(self, item):
+        with self.condition:
+            if self.thread is None:
+                self.thread = Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+            self.items.append(item)
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.items:
+                    self.condition.wait()
+
+                deadline = monotonic() + self.delay
+                while len(self.items) < self.max_items and deadline > monotonic():
+                    self.condition.wait(deadline - monotonic())
+
+                items = self.items[:self.max_items]
+                self.items = self.items[self.max_items:]
+
+            # * A failed flush must not stop the coalescer
+            try:
+                self.flush(items)
+            except Exception:
+                traceback.print_exc()
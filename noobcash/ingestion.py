@@ -0,0 +1,53 @@
+import queue
+import threading
+import traceback
+
+import noobcash
+
+class IngestionQueue:
+    '''
+        Bounded queue of received messages waiting to be handled by a fixed number of worker threads.
+        When the queue is full new messages are refused, so that the sender knows to back off instead of us piling up threads.
+    '''
+    def __init__(self, name, workers, maxsize):
+        self.messages = queue.Queue(maxsize=maxsize)
+
+        for i in range(workers):
+            worker = threading.Thread(target=self.work, name=f'{name}-{i}', daemon=True)
+            worker.start()
+
+    def submit(self, function, *args):
+        '''
+            Returns False without queueing the message if the queue is full.
+        '''
+        try:
+            self.messages.put_nowait((function, args))
+        except queue.Full:
+            return False
+
+        return True
+
+    def work(self):
+        while True:
+            function, args = self.messages.get()
+
+            # * A failing message must not take the worker down with it
+            try:
+                function(*args)
+            except Exception:
+                traceback.print_exc()
+
+# * Blocks get their own queue so that they are never stuck behind transactions, which may be waiting for a block to be accepted.
+# * Blocks are handled one at a time since they have to take the state lock anyway, and that way they are added in the order they arrived
+WORKERS = {'transactions': None, 'blocks': 1}
+
+queues: dict[str, IngestionQueue] = {}
+queues_lock = threading.Lock()
+
+def get_queue(name):
+    with queues_lock:
+        if name not in queues:
+            workers = WORKERS[name] if WORKERS[name] is not None else noobcash.INGESTION_WORKERS
+            queues[name] = IngestionQueue(name, workers, noobcash.INGESTION_QUEUE_SIZE)
+
+        return queues[name]
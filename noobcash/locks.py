@@ -0,0 +1,266 @@
+'''
+    The locks the node coordinates with. They are plain locks unless someone is looking:
+
+    - With METRICS_ENABLED they are TimedLocks, which feed the lock wait and hold time metrics.
+    - With LOCK_PROFILING they are ProfiledLocks. These also keep wait time, hold time and contention for every place in the code that takes them,
+      and who is holding and waiting for them. That is served on /locks, and a watchdog thread prints the stacks of the holder and of the waiting
+      threads whenever a lock is held for longer than LOCK_WATCHDOG_THRESHOLD seconds.
+'''
+import os
+import sys
+import threading
+import traceback
+from time import perf_counter, sleep
+
+import noobcash
+from noobcash import metrics
+
+# * How often (in seconds) the watchdog looks for locks that have been held too long
+WATCHDOG_INTERVAL = 1
+
+# * Frames in these files are skipped when finding out where a lock was taken, so that the call site is the code that asked for it
+SKIPPED_FILES = (__file__, threading.__file__)
+
+class TimedLock:
+    '''
+        A lock that records how long it was waited for and held in the lock metrics. Works with threading.Condition like a plain lock.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.owner = None
+        self.acquired_at = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        started = perf_counter()
+        acquired = self.lock.acquire(blocking, timeout)
+
+        if acquired:
+            self.acquired_at = perf_counter()
+            self.owner = threading.get_ident()
+            metrics.LOCK_WAIT_SECONDS.observe(self.acquired_at - started, self.name)
+
+        return acquired
+
+    def release(self):
+        held = perf_counter() - self.acquired_at
+        self.owner = None
+        self.lock.release()
+
+        metrics.LOCK_HOLD_SECONDS.observe(held, self.name)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def _is_owned(self):
+        # * Used by threading.Condition, which would otherwise find out by trying to acquire the lock
+        return self.owner == threading.get_ident()
+
+class _SiteStats:
+    def __init__(self):
+        self.acquisitions = 0
+        self.contentions = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+
+    def to_dict(self):
+        return {
+            'acquisitions': self.acquisitions,
+            'contentions': self.contentions,
+            'wait_total': self.wait_total,
+            'wait_max': self.wait_max,
+            'hold_total': self.hold_total,
+            'hold_max': self.hold_max,
+        }
+
+class ProfiledLock(TimedLock):
+    '''
+        A timed lock that also keeps statistics for every call site it is acquired from, and knows which thread holds it and which threads wait for it.
+    '''
+    def __init__(self, name):
+        super().__init__(name)
+        self.stats_lock = threading.Lock()
+        self.sites: dict[str, _SiteStats] = {}
+
+        # * The thread holding the lock and where it took it, and the threads waiting for it by thread id with where they are waiting
+        self.holder: tuple[int, str, str] | None = None
+        self.waiting: dict[int, tuple[str, str]] = {}
+
+        # * Counts the acquisitions, so the watchdog reports every long hold only once
+        self.holdings = 0
+
+        # * A new node replaces the locks of the previous one
+        profiled_locks[name] = self
+        start_watchdog()
+
+    def acquire(self, blocking=True, timeout=-1):
+        site = get_call_site()
+        thread = threading.current_thread()
+        started = perf_counter()
+
+        acquired = self.lock.acquire(False)
+        is_contended = not acquired
+
+        if is_contended and blocking:
+            with self.stats_lock:
+                self.waiting[thread.ident] = (thread.name, site)
+
+            acquired = self.lock.acquire(True, timeout)
+
+            with self.stats_lock:
+                del self.waiting[thread.ident]
+
+        now = perf_counter()
+
+        with self.stats_lock:
+            stats = self.sites.get(site)
+            if stats is None:
+                stats = self.sites[site] = _SiteStats()
+
+            stats.contentions += is_contended
+
+            if acquired:
+                stats.acquisitions += 1
+                stats.wait_total += now - started
+                stats.wait_max = max(stats.wait_max, now - started)
+
+                self.holder = (thread.ident, thread.name, site)
+                self.acquired_at = now
+                self.owner = thread.ident
+                self.holdings += 1
+
+        if acquired:
+            metrics.LOCK_WAIT_SECONDS.observe(now - started, self.name)
+
+        return acquired
+
+    def release(self):
+        now = perf_counter()
+
+        with self.stats_lock:
+            held = now - self.acquired_at
+
+            stats = self.sites[self.holder[2]]
+            stats.hold_total += held
+            stats.hold_max = max(stats.hold_max, held)
+
+            self.holder = None
+            self.owner = None
+
+        self.lock.release()
+
+        metrics.LOCK_HOLD_SECONDS.observe(held, self.name)
+
+    def to_dict(self, frames):
+        now = perf_counter()
+
+        with self.stats_lock:
+            holder = self.holder
+            held_for = now - self.acquired_at
+            waiting = dict(self.waiting)
+            sites = {site: stats.to_dict() for site, stats in self.sites.items()}
+
+        return {
+            'holder': None if holder is None else {
+                'thread': holder[1],
+                'site': holder[2],
+                'held_for': held_for,
+                'stack': format_stack(frames.get(holder[0])),
+            },
+            'waiting': [{ 'thread': thread_name, 'site': site, 'stack': format_stack(frames.get(ident)) } for ident, (thread_name, site) in waiting.items()],
+            # * The sites that waited the longest come first
+            'sites': dict(sorted(sites.items(), key=lambda item: item[1]['wait_total'], reverse=True)),
+        }
+
+profiled_locks: dict[str, ProfiledLock] = {}
+
+watchdog: threading.Thread | None = None
+watchdog_lock = threading.Lock()
+
+def create_lock(name):
+    '''
+        Returns a plain lock, or an instrumented one if metrics or lock profiling are enabled, so the node's locks cost nothing extra unless someone is looking.
+    '''
+    if noobcash.LOCK_PROFILING:
+        return ProfiledLock(name)
+
+    if noobcash.METRICS_ENABLED:
+        return TimedLock(name)
+
+    return threading.Lock()
+
+def get_call_site():
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_filename in SKIPPED_FILES:
+        frame = frame.f_back
+
+    if frame is None:
+        return 'unknown'
+
+    return f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} ({frame.f_code.co_name})'
+
+def format_stack(frame):
+    if frame is None:
+        return []
+
+    return [line.rstrip() for line in traceback.format_stack(frame)]
+
+def dump():
+    '''
+        The statistics, holder and waiting threads of every profiled lock.
+    '''
+    frames = sys._current_frames()
+
+    return {name: lock.to_dict(frames) for name, lock in list(profiled_locks.items())}
+
+def start_watchdog():
+    global watchdog
+
+    with watchdog_lock:
+        if watchdog is None:
+            watchdog = threading.Thread(target=watch, name='lock-watchdog', daemon=True)
+            watchdog.start()
+
+def watch():
+    '''
+        This function is run on the watchdog thread. It prints a report, once, for every time a lock is held longer than the threshold.
+    '''
+    reported = {}
+
+    while True:
+        sleep(WATCHDOG_INTERVAL)
+
+        for name, lock in list(profiled_locks.items()):
+            with lock.stats_lock:
+                holder = lock.holder
+                held_for = perf_counter() - lock.acquired_at
+                holdings = lock.holdings
+
+            if holder is None or held_for < noobcash.LOCK_WATCHDOG_THRESHOLD or reported.get(name) == holdings:
+                continue
+
+            reported[name] = holdings
+
+            try:
+                print(format_report(name, lock.to_dict(sys._current_frames())), file=sys.stderr, flush=True)
+            except Exception:
+                traceback.print_exc()
+
+def format_report(name, lock_info):
+    holder = lock_info['holder']
+    if holder is None:
+        return f'Lock {name} was held too long but has been released since'
+
+    lines = [f"Lock {name} held for {holder['held_for']:.2f}s by {holder['thread']} from {holder['site']}:", *holder['stack']]
+
+    for waiter in lock_info['waiting']:
+        lines.append(f"{waiter['thread']} waiting for it at {waiter['site']}:")
+        lines.extend(waiter['stack'])
+
+    return '\n'.join(lines)
@@ -1,29 +1,111 @@
-from copy import deepcopy
-import time
+import threading
+from time import monotonic, sleep
+import traceback
+
+import requests
+
 import noobcash
+from noobcash import broadcast
 from noobcash.api import transaction_api
+from noobcash.transaction import Transaction
+
+class _Entry:
+    def __init__(self, transaction):
+        self.transaction: Transaction = transaction
+        # * The peers that have accepted the transaction, they are never sent it again
+        self.acknowledged: set[str] = set()
+        self.attempts = 0
+        self.next_attempt = monotonic() + noobcash.MEMPOOL_RETRY_INTERVAL
+
+class Mempool:
+    '''
+        The transactions we created that are not in the blockchain yet.
+
+        For every transaction we remember which peers have accepted it, so a retry only goes to the peers that haven't.
+        Retries of the same transaction back off exponentially, and a transaction is dropped as soon as it is in the current state.
+        The mempool has its own lock, so it never needs the master state lock.
+    '''
+    def __init__(self):
+        self.entries: dict[str, _Entry] = {}
+        self.lock = threading.Lock()
+
+    def __setitem__(self, transaction_id, transaction: Transaction):
+        # * A transaction that comes back (because its block was yeeted) starts over, since the peers may have lost it too
+        with self.lock:
+            self.entries[transaction_id] = _Entry(transaction)
+
+    def __contains__(self, transaction_id):
+        return transaction_id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def items(self):
+        with self.lock:
+            return [(transaction_id, entry.transaction) for transaction_id, entry in self.entries.items()]
+
+    def acknowledge(self, transaction_id, node_id):
+        with self.lock:
+            entry = self.entries.get(transaction_id)
+            if entry is not None:
+                entry.acknowledged.add(node_id)
+
+    def get_due(self, processed_transactions):
+        '''
+            Drops the transactions that have been processed and returns the ones whose retry is due, scheduling their next retry.
+            Also returns how long until the next retry of any transaction.
+        '''
+        now = monotonic()
+        due = []
+        next_attempt = now + noobcash.MEMPOOL_RETRY_INTERVAL
+
+        with self.lock:
+            for transaction_id, entry in list(self.entries.items()):
+                if transaction_id in processed_transactions:
+                    del self.entries[transaction_id]
+                    continue
+
+                if entry.next_attempt <= now:
+                    entry.attempts += 1
+                    delay = noobcash.MEMPOOL_RETRY_INTERVAL * 2 ** entry.attempts
+                    entry.next_attempt = now + min(delay, noobcash.MEMPOOL_MAX_RETRY_INTERVAL)
+                    due.append((entry.transaction, set(entry.acknowledged)))
+
+                next_attempt = min(next_attempt, entry.next_attempt)
+
+        return due, next_attempt - now
+
+def send_transactions(node_id, transactions: list[Transaction]):
+    try:
+        response = transaction_api.post_transactions(noobcash.current_node.ring[node_id], transactions)
+    except requests.RequestException:
+        return
+
+    if response.status_code == 200:
+        for transaction in transactions:
+            noobcash.current_node.mempool.acknowledge(transaction.transaction_id, node_id)
 
 def broadcast_mempool():
     while True:
-        # * Copy node state for this iteration so that we dont crash if state is modified by another thread
-        noobcash.current_node.master_state_lock.acquire()
-                
-        active_state = deepcopy(noobcash.current_node.active_blocks_log[noobcash.current_node.active_block.uuid]) if noobcash.current_node.active_block is not None else deepcopy(noobcash.current_node.current_state)
-        
-        # * Clean up mempool from transactions that are in current state
-        for processed_transaction_id in list(noobcash.current_node.current_state.processed_transactions):
-            if processed_transaction_id in noobcash.current_node.mempool:
-                del noobcash.current_node.mempool[processed_transaction_id]
-                
-        mempool = deepcopy(noobcash.current_node.mempool)
-        noobcash.current_node.master_state_lock.release()
-        
-        # * Broadcast transactions and add them to active block
-        for transaction_id, transaction in mempool.items():
-            if transaction_id not in active_state.processed_transactions:  
-                noobcash.current_node.validate_and_add_transaction_to_block(transaction)
-            
-            transaction_api.broadcast_transaction(transaction=transaction)
-            
-        # * Sleep and then repeat
-        time.sleep(10)
\ No newline at end of file
+        # * The current state is only ever replaced, its contents never change, so reading it without the lock is fine
+        due, wait = noobcash.current_node.mempool.get_due(noobcash.current_node.current_state.processed_transactions)
+
+        try:
+            if due:
+                # * Put them back in our own block in case they were lost, the ones that are already there are just found invalid
+                noobcash.current_node.validate_and_add_transactions_to_block([transaction for transaction, _ in due])
+
+            # * Only send each peer the transactions it hasn't accepted yet, all peers at once
+            pending = {}
+            for transaction, acknowledged in due:
+                for node_id in noobcash.current_node.ring:
+                    if node_id != noobcash.current_node.id and node_id not in acknowledged:
+                        pending.setdefault(node_id, []).append(transaction)
+
+            for node_id, transactions in pending.items():
+                broadcast.get_pool().submit(send_transactions, node_id, transactions)
+        except Exception:
+            traceback.print_exc()
+
+        # * Sleep until the next retry is due
+        sleep(max(wait, 0.1))
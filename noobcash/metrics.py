@@ -0,0 +1,148 @@
+'''
+    Counters and histograms for tuning the node, served on /metrics in the Prometheus text format.
+
+    Nothing is recorded unless METRICS_ENABLED is set. Otherwise every inc, set and observe returns right away, so the calls can stay in the hot paths.
+'''
+from bisect import bisect_left
+import threading
+
+import noobcash
+
+# * Upper bounds (in seconds) of the buckets of the histograms that measure durations
+TIME_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+# * Upper bounds of the buckets of the histogram of nonces tried per block
+NONCE_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# * Upper bounds of the buckets of the histogram of how many of our blocks a consensus removed
+FORK_DEPTH_BUCKETS = (1, 2, 3, 5, 10, 20, 50)
+
+registry: list['Metric'] = []
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+        registry.append(self)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.extend(self.render_value(label_values, value))
+
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        if not noobcash.METRICS_ENABLED:
+            return
+
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render_value(self, label_values, value):
+        return [f'{self.name}{format_labels(self.label_names, label_values)} {format_value(value)}']
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        if not noobcash.METRICS_ENABLED:
+            return
+
+        with self.lock:
+            self.values[labels] = value
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        if not noobcash.METRICS_ENABLED:
+            return
+
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                # * One count per bucket plus the +Inf one, then the sum
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0]
+
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def render_value(self, label_values, counts):
+        lines = []
+
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            labels = format_labels(self.label_names, label_values, [('le', format_value(float(bound)))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+
+        labels = format_labels(self.label_names, label_values)
+        lines.append(f'{self.name}_sum{labels} {format_value(counts[-1])}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+
+        return lines
+
+def render():
+    '''
+        All the metrics in the Prometheus text exposition format.
+    '''
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+
+    return '\n'.join(lines) + '\n'
+
+# * Mining
+HASHES = Counter('noobcash_hashes_total', 'Nonces tried by all searches, its rate is the hash rate.')
+HASH_RATE = Gauge('noobcash_hash_rate', 'Nonces tried per second by the last search.')
+BLOCK_NONCES = Histogram('noobcash_block_nonces', 'Nonces tried to mine each block.', NONCE_BUCKETS)
+MINING_SECONDS = Histogram('noobcash_mining_seconds', 'Time spent searching for the nonce of each block, by whether it was mined or cancelled.', TIME_BUCKETS, ['result'])
+WASTED_HASHES = Counter('noobcash_wasted_hashes_total', 'Nonces tried by searches that were cancelled.')
+ABORT_SECONDS = Histogram('noobcash_mining_abort_seconds', 'Time from cancelling a search until it stopped.', TIME_BUCKETS)
+
+# * Block pipeline
+TRANSACTIONS = Counter('noobcash_transactions_total', 'New transactions added to our blocks.')
+BLOCK_FILL_SECONDS = Histogram('noobcash_block_fill_seconds', 'Time from the first transaction of a block until it was sealed.', TIME_BUCKETS)
+SEALED_BLOCKS = Gauge('noobcash_sealed_blocks', 'Blocks sealed and waiting to be mined, including the one being mined.')
+BLOCKS = Counter('noobcash_blocks_total', 'Blocks added to our chain, by whether we mined them, received them or switched to them in a consensus.', ['origin'])
+
+# * Validation
+TRANSACTION_VALIDATION_SECONDS = Histogram('noobcash_transaction_validation_seconds', 'Time to validate a transaction against a state.', TIME_BUCKETS)
+BLOCK_VALIDATION_SECONDS = Histogram('noobcash_block_validation_seconds', 'Time to validate a received block against a state.', TIME_BUCKETS)
+
+# * Consensus
+CONSENSUS_SECONDS = Histogram('noobcash_consensus_seconds', 'Duration of each consensus.', TIME_BUCKETS)
+FORK_DEPTH = Histogram('noobcash_fork_depth', 'Blocks removed from our chain when a consensus switched to another chain.', FORK_DEPTH_BUCKETS)
+
+# * Locks
+LOCK_WAIT_SECONDS = Histogram('noobcash_lock_wait_seconds', 'Time spent waiting to acquire each node lock.', TIME_BUCKETS, ['lock'])
+LOCK_HOLD_SECONDS = Histogram('noobcash_lock_hold_seconds', 'Time each node lock was held.', TIME_BUCKETS, ['lock'])
@@ -0,0 +1,335 @@
+import hashlib
+import logging
+import multiprocessing
+import queue
+import threading
+from time import perf_counter
+
+import noobcash
+from noobcash import metrics
+
+logger = logging.getLogger()
+
+# * How many nonces a search tries before it checks again whether it should stop, which bounds the hashes wasted after a cancel
+CHECK_INTERVAL = 256
+
+# * Searches expected to need fewer hashes than this (2 ** difficulty) run in the calling thread, handing them to the pool would cost more than it saves
+MIN_POOL_WORK = 2 ** 12
+
+# * How often (in seconds) a search on the pool checks that its workers are still alive while it waits for them
+WORKER_CHECK_INTERVAL = 1
+
+# * Nonces are hashed as fixed width big endian integers so that every attempt hashes the same amount of bytes
+NONCE_BYTES = 8
+
+# * Size of a SHA256 digest in bits
+DIGEST_BITS = 256
+
+def get_target(difficulty: int):
+    '''
+        A digest starts with `difficulty` zero bits exactly when, read as a big endian integer, it is below this target.
+    '''
+    return 1 << (DIGEST_BITS - difficulty)
+
+def meets_target(digest: bytes, target: int):
+    return int.from_bytes(digest, 'big') < target
+
+def meets_difficulty(digest: bytes, difficulty: int):
+    return meets_target(digest, get_target(difficulty))
+
+class _Flag:
+    '''
+        Stop flag of a search that runs in this process, read and raised just like the shared memory one of the workers.
+    '''
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+class _PoolFlag:
+    '''
+        Stop flag of a search on the pool. It is a byte of shared memory that the workers read, and raising it also wakes up the thread waiting
+        for the search, so the search returns as soon as it is cancelled instead of once every worker has noticed.
+    '''
+    __slots__ = ('flag', 'stopped')
+
+    def __init__(self, flag, stopped):
+        self.flag = flag
+        self.stopped = stopped
+
+    @property
+    def value(self):
+        return self.flag.value
+
+    @value.setter
+    def value(self, value):
+        self.flag.value = value
+        if value:
+            self.stopped.set()
+
+class CancellationToken:
+    '''
+        Stops a search from any thread. A running search attaches its stop flag to the token: a plain one in process, or a byte of shared memory
+        when it runs on worker processes. Either way the search only needs a plain read every CHECK_INTERVAL attempts to honor a cancel.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flag = None
+        self.cancelled_at: float | None = None
+
+    def attach(self, flag):
+        '''
+            Makes cancel raise the given stop flag, and raises it right away if the token has already been cancelled.
+        '''
+        with self.lock:
+            self.flag = flag
+            if self.cancelled_at is not None:
+                flag.value = 1
+
+        return flag
+
+    def detach(self):
+        with self.lock:
+            self.flag = None
+
+    def cancel(self):
+        with self.lock:
+            if self.cancelled_at is None:
+                self.cancelled_at = perf_counter()
+            if self.flag is not None:
+                self.flag.value = 1
+
+    def is_cancelled(self):
+        return self.cancelled_at is not None
+
+class MiningStats:
+    '''
+        How many hashes the searches tried, and for the cancelled ones how long they took to stop after the cancel and how many hashes they wasted.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.searches = 0
+        self.hashes = 0
+        self.aborts = 0
+        self.wasted_hashes = 0
+        self.abort_latency_total = 0.0
+        self.abort_latency_max = 0.0
+
+    def record(self, attempts, abort_latency=None):
+        with self.lock:
+            self.searches += 1
+            self.hashes += attempts
+
+            if abort_latency is not None:
+                self.aborts += 1
+                self.wasted_hashes += attempts
+                self.abort_latency_total += abort_latency
+                self.abort_latency_max = max(self.abort_latency_max, abort_latency)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'searches': self.searches,
+                'hashes': self.hashes,
+                'aborts': self.aborts,
+                'wasted_hashes': self.wasted_hashes,
+                'average_abort_latency': self.abort_latency_total / self.aborts if self.aborts else 0.0,
+                'max_abort_latency': self.abort_latency_max,
+            }
+
+stats = MiningStats()
+
+def search(header: bytes, difficulty: int, token: CancellationToken, processes=None):
+    '''
+        Looks for a nonce that gives a valid hash when appended to the given block header, on the pool of worker processes if there is one
+        and the difficulty is high enough for it to pay off, or in the calling thread otherwise.
+        Returns (nonce, digest) of the first valid hash found or None if the token was cancelled before that.
+    '''
+    processes = noobcash.MINING_PROCESSES if processes is None else processes
+    started = perf_counter()
+
+    if processes <= 1 or 2 ** difficulty < MIN_POOL_WORK:
+        nonce, attempts = _search(header, difficulty, 0, 1, token.attach(_Flag()))
+        token.detach()
+    else:
+        nonce, attempts = get_pool(processes).search(header, difficulty, token)
+
+    ended = perf_counter()
+    # * A search that found its nonce wasted nothing, even if the cancel came in while it was finishing
+    abort_latency = ended - token.cancelled_at if nonce is None and token.is_cancelled() else None
+    stats.record(attempts, abort_latency)
+
+    metrics.HASHES.inc(amount=attempts)
+    if ended > started:
+        metrics.HASH_RATE.set(attempts / (ended - started))
+
+    if abort_latency is not None:
+        logger.info(f'Mining-Abort: stopped {abort_latency * 1000:.3f}ms after the cancel, {attempts} hashes wasted')
+        metrics.MINING_SECONDS.observe(ended - started, 'cancelled')
+        metrics.WASTED_HASHES.inc(amount=attempts)
+        metrics.ABORT_SECONDS.observe(abort_latency)
+    elif nonce is not None:
+        metrics.MINING_SECONDS.observe(ended - started, 'mined')
+        metrics.BLOCK_NONCES.observe(attempts)
+
+    if nonce is None:
+        return None
+
+    return nonce, compute_digest(hashlib.sha256(header), nonce)
+
+def encode_nonce(nonce: int):
+    return nonce.to_bytes(NONCE_BYTES, 'big')
+
+def compute_digest(midstate, nonce: int):
+    '''
+        Finishes the hash of a header whose midstate has already been computed, without touching the midstate itself.
+    '''
+    my_hash = midstate.copy()
+    my_hash.update(encode_nonce(nonce))
+
+    return my_hash.digest()
+
+def _search(header, difficulty, start, step, stop_flag, progress=None, index=0):
+    '''
+        Tries the nonces start, start + step, ... until one is valid or the stop flag is raised.
+        Returns the valid nonce, or None if it was stopped, and how many nonces it tried. If progress is given, progress[index] is kept up to date
+        with how many nonces it has tried so far.
+    '''
+    # * The header is hashed once per search and every attempt only copies that state and hashes the nonce
+    midstate = hashlib.sha256(header)
+    target = get_target(difficulty)
+
+    nonce = start
+    attempts = 0
+    while not stop_flag.value:
+        for _ in range(CHECK_INTERVAL):
+            attempts += 1
+            if meets_target(compute_digest(midstate, nonce), target):
+                return nonce, attempts
+            nonce += step
+
+        if progress is not None:
+            progress[index] = attempts
+
+    return None, attempts
+
+class _Pool:
+    '''
+        Worker processes that are started once and take part in every search after that, one search at a time.
+        The nonce space is split in strides across them, so worker i tries i, i + processes, i + 2*processes, ...
+    '''
+    def __init__(self, processes):
+        context = _get_context()
+
+        self.processes = processes
+        self.lock = threading.Lock()
+
+        # * Shared with the workers: raised by a cancel or by the first worker that finds a hash, which also writes its nonce. stopped is set along
+        # * with the flag and is what the search waits on
+        self.stop_flag = context.Value('b', 0, lock=False)
+        self.stopped = context.Event()
+        self.found_nonce = context.Value('q', -1, lock=False)
+        self.attempts = context.Array('Q', processes, lock=False)
+
+        self.jobs = [context.SimpleQueue() for _ in range(processes)]
+        self.done = context.Queue()
+
+        # * Workers of the last search that haven't reported back yet. A search returns as soon as it is stopped, the workers finish on their own
+        self.running = 0
+
+        self.workers = [context.Process(target=_worker, args=(index, processes, self.jobs[index], self.done, self.stop_flag, self.stopped, self.found_nonce, self.attempts), daemon=True)
+                        for index in range(processes)]
+        for worker in self.workers:
+            worker.start()
+
+    def is_alive(self):
+        return all(worker.is_alive() for worker in self.workers)
+
+    def close(self):
+        for worker in self.workers:
+            worker.terminate()
+
+    def search(self, header, difficulty, token: CancellationToken):
+        '''
+            Returns the nonce found, or None if the search was cancelled or a worker died, and how many nonces were tried.
+            The count is read as soon as the search stops, so it misses the last few nonces (less than CHECK_INTERVAL) each worker tries before it notices.
+        '''
+        with self.lock:
+            self.collect()
+
+            self.stop_flag.value = 0
+            self.stopped.clear()
+            self.found_nonce.value = -1
+            for index in range(self.processes):
+                self.attempts[index] = 0
+            token.attach(_PoolFlag(self.stop_flag, self.stopped))
+
+            for jobs in self.jobs:
+                jobs.put((header, difficulty))
+            self.running = self.processes
+
+            while not self.stopped.wait(WORKER_CHECK_INTERVAL):
+                if not self.is_alive():
+                    # * A worker that is gone will never find its share of the nonces, stop the rest and leave the pool to be replaced
+                    self.stop_flag.value = 1
+                    break
+
+            # * Detached while still holding the pool, so that a late cancel can't stop the next search
+            token.detach()
+
+            nonce = self.found_nonce.value if self.found_nonce.value >= 0 else None
+
+            return nonce, sum(self.attempts)
+
+    def collect(self):
+        '''
+            Waits for the workers of the last search to report back, which they do within CHECK_INTERVAL nonces of it being stopped.
+            Must be run with the pool lock held.
+        '''
+        while self.running:
+            try:
+                self.done.get(timeout=WORKER_CHECK_INTERVAL)
+                self.running -= 1
+            except queue.Empty:
+                if not self.is_alive():
+                    break
+
+pool: _Pool | None = None
+pool_lock = threading.Lock()
+
+def get_pool(processes):
+    global pool
+
+    with pool_lock:
+        if pool is not None and (pool.processes != processes or not pool.is_alive()):
+            pool.close()
+            pool = None
+
+        if pool is None:
+            pool = _Pool(processes)
+
+        return pool
+
+def _worker(index, step, jobs, done, stop_flag, stopped, found_nonce, attempts):
+    '''
+        This function is run on a worker process of the pool for as long as the node lives.
+    '''
+    while True:
+        header, difficulty = jobs.get()
+
+        nonce, attempts[index] = _search(header, difficulty, index, step, stop_flag, attempts, index)
+
+        if nonce is not None:
+            # * The nonce is written before the search is woken up, which reads it right away
+            found_nonce.value = nonce
+            stop_flag.value = 1
+            stopped.set()
+
+        done.put(index)
+
+def _get_context():
+    # * Forking is by far the cheapest way to start the workers, fall back to the platform default where it is not available
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+
+    return multiprocessing.get_context()
@@ -1,29 +1,37 @@
 # import block
 import base64
-from copy import deepcopy
+from collections import OrderedDict
 from functools import partial
 import logging
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from time import time
+from time import perf_counter, time
 
 import Crypto
 import requests
 from Crypto.Hash import SHA256
 
 import noobcash
+from noobcash import broadcast, locks, metrics
 from noobcash.api import blockchain_api, block_api
 from noobcash.block import Block
 from noobcash.blockchain import Blockchain
 from noobcash.exceptions import InsufficientFundsException, NegativeAmountException
+from noobcash.mempool import Mempool
 from noobcash.transaction import Transaction
 from noobcash.transaction_input import TransactionInput
 from noobcash.transaction_output import TransactionOutput
 from noobcash.wallet import Wallet
 from noobcash.state import State
+from noobcash.shadow_log import ShadowLog
+from noobcash.snapshot import Snapshot
 
 logger = logging.getLogger()
 
+# * How many chains we remember by their last block after validating them in a consensus, valid or not
+VALIDATED_CHAINS = 8
+
 started_block_counting = False
 started_trans_counting = False
 class Node:
@@ -35,25 +43,53 @@ class Node:
         
         # Here we store non changing information for every node, as its id, its address (ip:port) its public key 
         self.ring = { '0': { 'ip': '127.0.0.1', 'port': '5000' } }
+        
+        # * Maps every public key in the ring to its node id, must be updated through update_ring_index whenever the ring changes
+        self.ring_index: dict[str, str] = {}
 
         self.active_block = None
         self.mining_block = None
         
+        # * The blocks that filled up and wait to be mined, in chain order: each block's parent is the one before it, and the first one's parent is the
+        # * last block of the chain. The first one is the mining block once mining has started. The active block is filled on top of the last one.
+        self.sealed_blocks: list[Block] = []
+        
+        # * Mines the sealed blocks one after the other, started when the first block is sealed
+        self.mining_thread: threading.Thread | None = None
+        
+        # * When the first transaction went into the active block, for the block fill time metric
+        self.active_block_started = 0.0
+        
         # * This holds the state of all blocks in the blockchain
-        self.shadow_log: dict[str, State] = {}
+        self.shadow_log: ShadowLog = ShadowLog()
         
         # * This holds the state of all the blocks currently being processed
-        # * This can be: 1. The block i am currently adding transactions to, 2. The block being mined
+        # * This can be: 1. The block i am currently adding transactions to, 2. The sealed blocks, including the one being mined
         self.active_blocks_log: dict[str, State] = {}
         
         self.current_state: State | None = None
 
-        self.mining_lock = threading.Lock()
-        self.master_state_lock = threading.Lock()
-        self.mining_sem = threading.Semaphore(value=2)
+        # * Signature checks don't depend on the state, so they run on this pool before we take any lock
+        self.verification_pool = ThreadPoolExecutor(max_workers=noobcash.VERIFICATION_WORKERS)
+        
+        # * Chains we have validated during consensus by the hash of their last block, or None for the ones that were invalid
+        self.validated_chains: OrderedDict[str, tuple | None] = OrderedDict()
+
+        # * Locks, always taken in this order when more than one is needed:
+        # * 1. chain_lock guards the blockchain, the shadow log and the current state. Changing any of them also needs the block lock,
+        # *    so holding either of the two is enough to read them.
+        # * 2. block_lock guards the active, sealed and mining blocks and their states. block_condition is signaled whenever a block is sealed.
+        # * 3. wallet_lock guards the wallet.
+        self.chain_lock = locks.create_lock('chain')
+        self.block_lock = locks.create_lock('block')
+        self.block_condition = threading.Condition(self.block_lock)
+        self.wallet_lock = locks.create_lock('wallet')
+        
+        # * What the read endpoints are served from, replaced (never changed) by publish_snapshot
+        self.snapshot: Snapshot | None = None
         
         # * This contains all transactions we have created and are not in the blockchain
-        self.mempool = {}
+        self.mempool = Mempool()
 
         # * Metric variables
         self.block_time = 0
@@ -79,12 +115,12 @@ class Node:
         
         for transaction_input in genesis_transaction.transaction_inputs:
             self.wallet.STXOs.add(transaction_input.id)
-        self.wallet.UTXOs = []
         self.wallet.add_transaction_output(genesis_transaction_output)
         
         self.id = '0'
         
         self.ring[self.id]['public_key'] = self.wallet.public_key.decode()
+        self.update_ring_index()
         
         self.blockchain = Blockchain()
         self.blockchain.add_block(genesis_block)
@@ -92,7 +128,8 @@ class Node:
         initial_utxo_dict = {str(node_id): {} for node_id in range(noobcash.NODE_NUM)}
         initial_utxo_dict['0'] = { genesis_transaction_output.id: genesis_transaction_output}
         self.current_state = State(initial_utxo_dict, { genesis_transaction.transaction_id })
-        self.shadow_log[genesis_block.hash] = deepcopy(self.current_state)
+        self.shadow_log.add(genesis_block.hash, genesis_block.previous_hash, self.current_state)
+        self.publish_snapshot()
 
     #####################################**######################################
     ##########################* Transaction functions *##########################
@@ -104,6 +141,8 @@ class Node:
         ''' 
         # 1. make sure that transaction signature is valid
         # 2. check that the sender node has enough balance based on its UTXOs
+        started = perf_counter()
+        
         # * Check that transaction is not already in blockchain
         is_not_already_processed = transaction.transaction_id not in state.processed_transactions
         
@@ -123,6 +162,8 @@ class Node:
         
         is_valid_transaction = is_not_already_processed and has_valid_signature and not has_invalid_transaction_inputs
         
+        metrics.TRANSACTION_VALIDATION_SECONDS.observe(perf_counter() - started)
+        
         return is_valid_transaction
     
     def process_transaction(self, transaction: Transaction, state: State):
@@ -160,71 +201,42 @@ class Node:
             at the moment based on the active state, but it will certainly be valid at some state of the blockchain if we don't lose any transactions.
         '''
         
-        # * We can only add new transactions to the block if there are not 2 blocks currently trying to be mined: otherwise wait
-        self.mining_sem.acquire()
-        # print(f'{self.id} acquiring master lock create_transaction_and_add_to_block')
-        self.master_state_lock.acquire()
-        # print(f'{self.id} acquired master lock create_transaction_and_add_to_block')
-        
-        # Create a transaction with someone giving them the requested amount
-        self.update_current_block()
+        # * Only the wallet lock is held while picking and spending the coins, the block lock is only needed to add the transaction to the block
+        self.wallet_lock.acquire()
         
         receiver_public_key = self.ring[node_id]['public_key']
-        active_state = self.active_blocks_log[self.active_block.uuid]
         
         public_key, private_key = self.wallet.get_key_pair()
-        my_UTXOs = [utxo for utxo in self.wallet.UTXOs]
+        my_UTXOs = self.wallet.select_coins(amount)
         
         transaction_inputs = [TransactionInput(UTXO) for UTXO in my_UTXOs]
         
         # Try creating it and handle the error of not having enough balance
         try:
             new_transaction = Transaction(public_key.decode(), receiver_public_key, amount=amount, transaction_inputs=transaction_inputs)
-        except InsufficientFundsException as e:
-            # print(f'{self.id} releasing master lock create_transaction_and_add_to_block')
-            self.master_state_lock.release()
-            self.mining_sem.release()
-            raise e
-        except NegativeAmountException as e:
-            # print(f'{self.id} releasing master lock create_transaction_and_add_to_block')
-            self.master_state_lock.release()
-            self.mining_sem.release()
+        except (InsufficientFundsException, NegativeAmountException) as e:
+            self.wallet_lock.release()
             raise e
         
+        # * Update wallet, the change is ours as soon as the coins are spent so that the next transaction can already spend it
+        self.wallet.spend(my_UTXOs)
+        self.wallet.add_transaction_output(new_transaction.get_sender_transaction_output())
+        self.publish_wallet_snapshot()
+        self.wallet_lock.release()
+        
         # Sign the transaction
+        # * Signing is the slow part and doesn't need any lock
         new_transaction.sign_transaction(private_key)
         
         # * Add the newly created transaction to the mempool
         self.mempool[new_transaction.transaction_id] = new_transaction
         
-        # * Update wallet
-        for utxo in my_UTXOs:
-            self.wallet.STXOs.add(utxo.id)
-        self.wallet.UTXOs = []
-        self.wallet.add_transaction_output(new_transaction.get_sender_transaction_output())
+        self.block_lock.acquire()
         
-        # * Only if valid based on active state, process it
-        if self.validate_transaction(new_transaction, active_state):
-            self.process_transaction(new_transaction, active_state)
-            self.active_block.add_transaction(new_transaction)
-            
-            # * Calculating metrics
-            if self.started_trans_counting:
-                self.trans_count += 1
-                self.trans_time += time() - self.start_trans_time
-                logger.info(f'Current-Thoughput({self.trans_count}): {self.trans_count / self.trans_time}')
-            else:
-                self.started_trans_counting = True
-            self.start_trans_time = time()
-            # * Done calculating for this transaction
-            
-            # * If capacity reached, start mining
-            if self.active_block.capacity == self.active_block.get_length():
-                self.mine_current_block()
+        # * Only if valid based on active state, process it (if not the mempool will add it later)
+        self.add_transaction_to_active_block(new_transaction)
         
-        # print(f'{self.id} releasing master lock create_transaction_and_add_to_block')
-        self.master_state_lock.release()
-        self.mining_sem.release()
+        self.block_lock.release()
         
         return new_transaction
     
@@ -232,39 +244,101 @@ class Node:
         '''
             This function runs when we receive a transaction from another node, then we check its validity and we add it to the current block if valid.
         '''
-        self.mining_sem.acquire()
-        # print(f'{self.id} acquiring master lock validate_and_add_transaction_to_block')
-        self.master_state_lock.acquire()
-        # print(f'{self.id} acquired master lock validate_and_add_transaction_to_block')
+        # * Verify the signature outside the locks, validate_transaction will find it in the signature cache
+        transaction.verify_signature()
+        
+        self.block_lock.acquire()
+        
+        self.add_transaction_to_active_block(transaction)
+        
+        self.block_lock.release()
+        
+    def validate_and_add_transactions_to_block(self, transactions: list[Transaction]):
+        '''
+            Same as validate_and_add_transaction_to_block for a batch of transactions received together. Their signatures are verified in parallel
+            and then they are added in order under a single acquisition of the block lock.
+        '''
+        self.verify_signatures(transactions)
+        
+        self.block_lock.acquire()
+        
+        for transaction in transactions:
+            self.add_transaction_to_active_block(transaction)
+        
+        self.block_lock.release()
+        
+    def add_transaction_to_active_block(self, transaction: Transaction):
+        '''
+            Validates a new transaction against the active state and adds it to the active block if valid. Must be run with the block lock held.
+        '''
+        if not self.apply_to_active_block(transaction):
+            return
+            
+        # * Calculating metrics
+        if self.started_trans_counting:
+            self.trans_count += 1
+            self.trans_time += time() - self.start_trans_time
+            logger.info(f'Current-Thoughput({self.trans_count}): {self.trans_count / self.trans_time}')
+        else:
+            self.started_trans_counting = True
+        self.start_trans_time = time()
+        # * Done calculating for this transaction
         
+        metrics.TRANSACTIONS.inc()
+            
+    def apply_to_active_block(self, transaction: Transaction, is_rebase=False):
+        '''
+            Adds a transaction to the active block if it is valid based on the active state, and seals the block when it fills up.
+            Must be run with the block lock held. Returns True if the transaction was added.
+        '''
         # This creates a new block if one is not already active
         self.update_current_block()
         
         active_state = self.active_blocks_log[self.active_block.uuid]
         
-        is_valid = self.validate_transaction(transaction, active_state)
-        
-        if is_valid:
-            self.process_transaction(transaction, active_state)
-            
-            self.active_block.add_transaction(transaction)
+        if not self.validate_transaction(transaction, active_state):
+            return False
             
-            # * Calculating metrics
-            if self.started_trans_counting:
-                self.trans_count += 1
-                self.trans_time += time() - self.start_trans_time
-                logger.info(f'Current-Thoughput({self.trans_count}): {self.trans_count / self.trans_time}')
-            else:
-                self.started_trans_counting = True
-            self.start_trans_time = time()
-            # * Done calculating for this transaction
+        self.process_transaction(transaction, active_state)
+        self.active_block.add_transaction(transaction)
+        
+        if self.active_block.capacity == self.active_block.get_length():
+            self.seal_active_block(is_rebase)
             
-            if self.active_block.capacity == self.active_block.get_length():
-                self.mine_current_block()
+        return True
+        
+    def add_initial_utxo(self, utxo: TransactionOutput):
+        '''
+            Adds the coins the bootstrap node gives us to start with to our wallet.
+        '''
+        self.block_lock.acquire()
+        self.wallet_lock.acquire()
+        
+        self.wallet.add_transaction_output(utxo)
+        self.publish_snapshot()
+        
+        self.wallet_lock.release()
+        self.block_lock.release()
         
-        # print(f'{self.id} releasing master lock validate_and_add_transaction_to_block')
-        self.master_state_lock.release()
-        self.mining_sem.release()
+    def publish_snapshot(self):
+        '''
+            Publishes what the read endpoints are served from. Must be run with the block lock and the wallet lock held (or before the node is shared between threads).
+        '''
+        self.snapshot = Snapshot(tuple(self.blockchain.chain), self.current_state, tuple(self.wallet.UTXOs.values()), tuple(self.wallet.STXOs), self.wallet.balance())
+        
+    def publish_wallet_snapshot(self):
+        '''
+            Publishes a snapshot with the wallet as it is now and the chain of the last snapshot. Needs only the wallet lock, which every publisher holds.
+        '''
+        snapshot = self.snapshot
+        self.snapshot = Snapshot(snapshot.chain, snapshot.current_state, tuple(self.wallet.UTXOs.values()), tuple(self.wallet.STXOs), self.wallet.balance())
+        
+    def verify_signatures(self, transactions: list[Transaction]):
+        '''
+            Runs the checks that don't depend on any state (transaction id and signature) for all given transactions in parallel.
+            Valid signatures are remembered, so the ordered checks against the state that run later under the lock don't need to verify them again.
+        '''
+        return all(self.verification_pool.map(Transaction.verify_signature, transactions))
         
     #####################################**######################################
     #############################* Block functions *#############################
@@ -274,17 +348,48 @@ class Node:
         if self.active_block is not None:
             return
                 
-        if self.mining_block is not None:
-            # * Use the mining block's timestamp as previous hash so that before we start mining if the previous hash equals the latest blockchain block's timestamp
-            # * then we need toreplace our previous hash with its hash (found after it finished mining) else we must be yeeted
-            new_block = Block(self.mining_block.uuid)
-            mining_block_state = self.active_blocks_log[self.mining_block.uuid]
-            self.active_blocks_log[new_block.uuid] = deepcopy(mining_block_state)
+        if self.sealed_blocks:
+            # * The parent is the last sealed block, whose hash (our previous hash) is only known once it is mined, so it is set when we start mining
+            parent = self.sealed_blocks[-1]
+            new_block = Block(None)
+            self.active_blocks_log[new_block.uuid] = self.active_blocks_log[parent.uuid].fork()
         else:
             new_block = Block(self.blockchain.last_hash)
-            self.active_blocks_log[new_block.uuid] = deepcopy(self.current_state)
+            self.active_blocks_log[new_block.uuid] = self.current_state.fork()
         
         self.active_block = new_block
+        self.active_block_started = perf_counter()
+        
+    def rebase_blocks(self, discarded_blocks: list[Block] | None = None):
+        '''
+            Rebuilds the sealed and active blocks on top of the new last block of the chain instead of throwing them away, together with the
+            blocks a consensus removed from our chain, which come before them. Their transactions from every sender that are not in the current
+            state yet are validated again in order, which also drops the ones that are no longer valid.
+            Must be run with the chain lock and the block lock held, right after the chain changed.
+        '''
+        blocks = self.sealed_blocks + ([self.active_block] if self.active_block is not None else [])
+        active_block_started = self.active_block_started if self.active_block is not None else None
+        
+        for block in blocks:
+            # * This also stops the mining block, which is always the first sealed block, so the mining thread moves on to the rebased ones
+            block.cancel()
+            del self.active_blocks_log[block.uuid]
+            
+        self.sealed_blocks = []
+        self.active_block = None
+        
+        discarded_blocks = [] if discarded_blocks is None else discarded_blocks
+        
+        for block in discarded_blocks + blocks:
+            for transaction in block.list_of_transactions:
+                if transaction.transaction_id not in self.current_state.processed_transactions:
+                    self.apply_to_active_block(transaction, is_rebase=True)
+                    
+        # * The block left open goes on filling from intake, so its fill time still counts from when the block it replaces was started
+        if self.active_block is not None and active_block_started is not None:
+            self.active_block_started = active_block_started
+                    
+        metrics.SEALED_BLOCKS.set(len(self.sealed_blocks))
         
     def validate_block(self, block: Block, current_state: State):
         '''
@@ -292,7 +397,8 @@ class Node:
             We validate the given block based on the given state (which should be the current state of the blockchain)
         '''      
         # print(f"{self.id}:[validate_block] start")
-        block_state = deepcopy(current_state)
+        started = perf_counter()
+        block_state = current_state.fork()
                 
         has_invalid_transaction = False
         for transaction in block.list_of_transactions:
@@ -305,6 +411,7 @@ class Node:
         has_valid_hash = block.validate_hash()
         
         # print(f"{self.id}:[validate_block] has_valid_hash: {has_valid_hash}, has_invalid_transaction: {has_invalid_transaction}")
+        metrics.BLOCK_VALIDATION_SECONDS.observe(perf_counter() - started)
         
         if has_valid_hash and not has_invalid_transaction:
             return True, block_state
@@ -316,32 +423,30 @@ class Node:
             Add block that we received from another node to our blockchain after checking its validity. If it's not valid run a consensus to check we have the latest version
             of the blockchain.
         '''
-        # print(f'{self.id} acquiring master lock add_block_to_blockchain')
-        self.master_state_lock.acquire()
-        # print(f'{self.id} acquired master lock add_block_to_blockchain')
+        self.verify_signatures(block.list_of_transactions)
+        
+        # * Only the chain lock is held while validating, so new transactions keep being added to the active block in the meantime
+        self.chain_lock.acquire()
         
         is_valid_block, block_state = self.validate_block(block, self.current_state)
         is_next_block = self.blockchain.last_hash == block.previous_hash
         
         if is_valid_block and is_next_block:
-            # print(f'adding block')
+            self.block_lock.acquire()
+            self.wallet_lock.acquire()
+            
             # * Update blockchain
             self.blockchain.add_block(block)
-            self.shadow_log[block.hash] = deepcopy(block_state)
-            self.current_state = deepcopy(block_state)
+            self.shadow_log.add(block.hash, block.previous_hash, block_state)
+            self.current_state = block_state.fork()
             
-            # * Update my wallet UTXOs based on new current state
-            for _, utxo in self.current_state.utxos[self.id].items():
+            # * Update my wallet UTXOs with the ones the block created
+            for utxo in block_state.delta().created[self.id].values():
                 self.wallet.add_transaction_output(utxo)
             
-            if self.mining_block is not None:
-                self.mining_block.failed = True
-                
-            if self.active_block is not None:
-                self.active_block.failed = True
-                if self.active_block.uuid in self.active_blocks_log:
-                    del self.active_blocks_log[self.active_block.uuid]
-                self.active_block = None
+            # * The blocks we were filling and mining are moved on top of the new block
+            self.rebase_blocks()
+            metrics.BLOCKS.inc('received')
             
             # * Calculating metrics
             if self.started_block_counting:
@@ -351,17 +456,15 @@ class Node:
                 self.started_block_counting = True
             self.start_block_time = time()
             # * Done calculating for this block
-
-            # print(f'{self.id} releasing master lock add_block_to_blockchain')
-            self.master_state_lock.release()
-            # print(f'{self.id}: done adding block')
+            
+            self.publish_snapshot()
+            self.wallet_lock.release()
+            self.block_lock.release()
+            self.chain_lock.release()
             return True
         else:
-            # print(f'{self.id}: consensus')
             self.consensus()
-            # print(f'{self.id}: run consensus')
-            # print(f'{self.id} releasing master lock add_block_to_blockchain')
-            self.master_state_lock.release()
+            self.chain_lock.release()
             return False   
                  
     def yeet_block(self, block_to_be_yeeted: Block):
@@ -381,34 +484,24 @@ class Node:
         '''
             This function runs during consensus when we receive blockchains from the other nodes to find the longest one.
             After having sent our own chain of hashes we receive the partial chain with the blocks we disagree with the other node and the hash of the last block we agree on.
+            Returns the states of the blocks in the partial chain, in order, to be added to the shadow log if this chain wins.
         '''
-        # print('i am in validate_blockchain whaaaaattttt')
-        # * Set up incoming_blockchains shadow_log up to the point where we disagree
-        blockchains_shadow_log = {}
-        is_last_consensual_block_in_our_blockchain = False
-        
-        for block in self.blockchain.chain:
-            blockchains_shadow_log[block.hash] = deepcopy(self.shadow_log[block.hash])
-            
-            if last_consensual_block_hash == block.hash:
-                is_last_consensual_block_in_our_blockchain = True
-                break
-        
         # * Check that the other guy is not lying about last_consensual_block_hash
-        if not is_last_consensual_block_in_our_blockchain:
+        if last_consensual_block_hash not in self.blockchain:
             return False, None
         
         # * In case that we agree on all blocks in other node's blockchain just return
         if partial_chain.get_length() == 0:
-            return True, blockchains_shadow_log
+            return True, []
         
-        # * If partial_chain has blocks, validate them and expand blockchain's shadow_log
+        # * If partial_chain has blocks, validate them and keep their states
         is_continuation_of_our_chain = partial_chain.chain[0].previous_hash == last_consensual_block_hash
             
         if not is_continuation_of_our_chain:
             return False, None
             
-        current_state = deepcopy(blockchains_shadow_log[last_consensual_block_hash])
+        block_states = []
+        current_state = self.shadow_log[last_consensual_block_hash]
         previous_block_hash = last_consensual_block_hash
         for block in partial_chain.chain:
             is_block_valid, current_state = self.validate_block(block, current_state)
@@ -418,9 +511,9 @@ class Node:
             if not (is_block_valid and is_chain):
                 return False, None
             
-            blockchains_shadow_log[block.hash] = deepcopy(current_state)
+            block_states.append(current_state)
         
-        return True, blockchains_shadow_log
+        return True, block_states
 
     #####################################**######################################
     #####################* Consensus and helper functions *######################
@@ -429,67 +522,117 @@ class Node:
     def consensus(self):
         '''
             !!! WARNING !!!!    consensus is only run when we are using function "add block to blockchain" which receives a block from another node and initializes actions to
-                                check it and add it to the blockchain, which is always done with the master state locked.
+                                check it and add it to the blockchain, which is always done with the chain lock held. The block and wallet locks are only taken
+                                to switch to the winning chain, so transactions keep coming in while we talk to the other nodes and validate their chains.
             
             This function runs when we try to add a block to our blockchain and we fail to do so, due to failure of hashes. We a
         '''      
-        chains = []
+        started = perf_counter()
+        
+        # * Ask every peer for the headers of its chain at the same time. Only chains longer than ours can win, so the others don't even send them
+        futures = {}
         for key in self.ring.keys():
-            node_id = key
-            node_ip = self.ring[key]['ip']
-            node_port = self.ring[key]['port']
+            if key != self.id:
+                futures[key] = broadcast.get_pool().submit(blockchain_api.get_headers_from_node, self.ring[key], self.blockchain.get_length())
+        
+        candidates = []
+        for key, future in futures.items():
+            try:
+                fork_hash, headers = future.result()
+            except (requests.RequestException, ValueError):
+                continue
             
-            if node_id != self.id:
-                partial_chain, last_consensual_block_hash = blockchain_api.get_blockchain_from_node(node_ip, node_port)
-                is_valid, blockchain_shadow_log = self.validate_blockchain(partial_chain, last_consensual_block_hash)
-                if is_valid:
-                    chain = Blockchain()
-                    for block in self.blockchain.chain:
-                        chain.add_block(block)
-                        if block.hash == last_consensual_block_hash:
-                            break
-                    for block in partial_chain.chain:
-                        chain.add_block(block)
-                    
-                    chains.append({ 'chain': chain, 'shadow_log': blockchain_shadow_log, 'last_consensual_block_hash': last_consensual_block_hash })
+            if fork_hash is not None:
+                claimed_length = self.blockchain.get_height(fork_hash) + 1 + len(headers)
+                candidates.append((claimed_length, key, fork_hash, headers))
+        
+        # * Validate the longest claimed chain first and only move on to the next one if it turns out to be invalid
+        chains = []
+        for _, key, fork_hash, headers in sorted(candidates, key=lambda candidate: candidate[0], reverse=True):
+            chain = self.get_validated_chain(key, fork_hash, headers)
+            if chain is not None:
+                chains.append(chain)
+                break
             
-        chains.append({ 'chain': self.blockchain, 'shadow_log': self.shadow_log, 'last_consensual_block_hash': self.blockchain.last_hash })       
+        chains.append({ 'chain': self.blockchain, 'block_states': [], 'last_consensual_block_hash': self.blockchain.last_hash })       
         winner_chain = self.get_longest_chain(chains)
         last_consensual_block_hash = winner_chain['last_consensual_block_hash']
 
         if self.blockchain.last_hash == winner_chain['chain'].last_hash:
+            metrics.CONSENSUS_SECONDS.observe(perf_counter() - started)
             return
         
-        # * First we backup the blockchain to be able to re-do the transactions of the yeeted blocks. Then we update the blockchain and the other variables so that the hash
-        # * of the new block to be created will be the proper one. Afterwards, we yeet both the block we were creating and also the blocks we removed from our blockchain.
-        blockchain_backup = deepcopy(self.blockchain)
+        # * First we keep the blocks we are about to remove from our blockchain (the winning chain is always a new one), to re-do their transactions
+        # * on top of the winning chain along with the blocks we were filling and mining.
+        discarded_blocks = self.blockchain.chain[self.blockchain.get_height(last_consensual_block_hash) + 1:]
+        
+        self.block_lock.acquire()
+        self.wallet_lock.acquire()
         
         # * First update blockchain to the winning one
         self.blockchain: Blockchain = winner_chain['chain'] 
-        self.shadow_log: dict[str, State] = winner_chain['shadow_log']
+        self.shadow_log.truncate(last_consensual_block_hash)
+        for block, block_state in zip(self.blockchain.chain[-len(winner_chain['block_states']):], winner_chain['block_states']):
+            self.shadow_log.add(block.hash, block.previous_hash, block_state)
         self.current_state = self.shadow_log[self.blockchain.last_hash]
-        for _, utxo in self.current_state.utxos[self.id].items():
-            self.wallet.add_transaction_output(utxo)
-            
-        if self.mining_block is not None:
-            self.mining_block.failed = True
+        for block_state in winner_chain['block_states']:
+            for utxo in block_state.delta().created[self.id].values():
+                self.wallet.add_transaction_output(utxo)
             
-        if self.active_block is not None:
-            # * We update its 'failed' status in case there is another pointer to this block waiting to be mined at the lock (current_block in threaded_mining)
-            self.active_block.failed = True
-            if self.active_block.uuid in self.active_blocks_log:
-                del self.active_blocks_log[self.active_block.uuid]
-            self.active_block = None
-        
-        # * Before replacing blockchain add transactions that I created which will be removed from the blockchain to the mempool
-        should_be_yeeted = False
-        for block in blockchain_backup.chain:
-            if should_be_yeeted:
-                self.yeet_block(block)
-            else:
-                if block.hash == last_consensual_block_hash:
-                    should_be_yeeted = True
+        self.rebase_blocks(discarded_blocks)
+        
+        self.publish_snapshot()
+        self.wallet_lock.release()
+        self.block_lock.release()
+        
+        metrics.BLOCKS.inc('consensus', amount=len(winner_chain['block_states']))
+        metrics.FORK_DEPTH.observe(len(discarded_blocks))
+        metrics.CONSENSUS_SECONDS.observe(perf_counter() - started)
+        
+        # * Our own transactions from the removed blocks also go back to the mempool, in case the peers lost them too
+        for block in discarded_blocks:
+            self.yeet_block(block)
 
+    def get_validated_chain(self, node_id, fork_hash, headers):
+        '''
+            Returns the node's chain that ends with the given headers, fetching and validating its blocks unless we have already validated a chain ending in the same block.
+            Returns None if the chain is invalid or its blocks couldn't be fetched.
+        '''
+        tip_hash = headers[-1]['hash']
+        
+        if tip_hash in self.validated_chains and self.validated_chains[tip_hash] is None:
+            return None
+        
+        # * Chains ending in the same block are the same chain, so we can reuse it as long as we still have the block it forks from
+        if tip_hash in self.validated_chains and self.validated_chains[tip_hash][0] in self.blockchain:
+            self.validated_chains.move_to_end(tip_hash)
+            last_consensual_block_hash, partial_chain, block_states = self.validated_chains[tip_hash]
+        else:
+            try:
+                partial_chain = blockchain_api.get_blocks_from_node(self.ring[node_id], headers)
+            except (requests.RequestException, ValueError):
+                return None
+            
+            if partial_chain is None:
+                return None
+            
+            last_consensual_block_hash = fork_hash
+            self.verify_signatures([transaction for block in partial_chain.chain for transaction in block.list_of_transactions])
+            is_valid, block_states = self.validate_blockchain(partial_chain, last_consensual_block_hash)
+            
+            self.validated_chains[tip_hash] = (last_consensual_block_hash, partial_chain, block_states) if is_valid else None
+            if len(self.validated_chains) > VALIDATED_CHAINS:
+                self.validated_chains.popitem(last=False)
+                
+            if not is_valid:
+                return None
+        
+        chain = self.blockchain.up_to(last_consensual_block_hash)
+        for block in partial_chain.chain:
+            chain.add_block(block)
+            
+        return { 'chain': chain, 'block_states': block_states, 'last_consensual_block_hash': last_consensual_block_hash }
+        
     def get_longest_chain(self, chains):
         '''
             Just returns the first longest chain from a list of chains.
@@ -505,107 +648,72 @@ class Node:
                 
         return winner
     
-    def get_partial_chain(self, hash_list):
-        '''
-            After receiving the hash_list of the node requesting our blockchain, we return the chain from the point we disagree on and also the hash of the last block we agree on.
-        '''
-        last_consensual_hash = None
-        partial_chain = Blockchain()
-        
-        for i, block in enumerate(self.blockchain.chain):
-            if last_consensual_hash is None:
-                try:
-                    if block.hash != hash_list[i]:
-                        last_consensual_hash = block.previous_hash
-                        partial_chain.add_block(block) 
-                except:
-                    last_consensual_hash = block.previous_hash
-                    partial_chain.add_block(block)
-            else:
-                partial_chain.add_block(block)
-
-        last_consensual_hash = last_consensual_hash if last_consensual_hash is not None else self.blockchain.last_hash
-
-        return partial_chain, last_consensual_hash
-    
     #####################################**######################################
     ############################* Mining functions *#############################
     #####################################**######################################
     
-    def mine_current_block(self):
-        # * This holds the states of our currently mining blocks
-        mining_thread = threading.Thread(target=self.threaded_mining, args=(self.active_block, self.mining_end))
-        mining_thread.start()
-        
-        self.active_block = None
-    
-    def threaded_mining(self, current_block: Block, callback_function):
+    def seal_active_block(self, is_rebase=False):
         '''
-            This function is run on another thread.
+            Queues the full active block to be mined after the blocks sealed before it. Must be run with the block lock held.
+            Blocks filled again by a rebase are not counted in the block fill time, which is about how long intake takes to fill a block.
         '''
-        self.mining_sem.acquire()
-        self.mining_lock.acquire()
-        # print(f'{self.id} acquiring master lock threaded_mining')
-        self.master_state_lock.acquire()
-        # print(f'{self.id} acquired master lock threaded_mining')
-        
-        self.mining_block = current_block
+        self.sealed_blocks.append(self.active_block)
+        self.active_block = None
+        self.block_condition.notify_all()
         
-        if self.mining_block.previous_hash == self.blockchain.chain[-1].uuid:
-            # * If I was created with the assumption that a previous mining block would have entered the blockchain by now then I should check that it actually did
-            self.mining_block.previous_hash = self.blockchain.last_hash
+        if not is_rebase:
+            metrics.BLOCK_FILL_SECONDS.observe(perf_counter() - self.active_block_started)
+        metrics.SEALED_BLOCKS.set(len(self.sealed_blocks))
         
-        if self.mining_block.previous_hash != self.blockchain.last_hash or current_block.failed:
-            # * If I was created to further the current blockchain, I should check that the blockchain hasn't changed since then
-            self.mining_block.failed = True
-            del self.active_blocks_log[self.mining_block.uuid]
-            self.mining_block = None
+        if self.mining_thread is None:
+            self.mining_thread = threading.Thread(target=self.mine_sealed_blocks, daemon=True)
+            self.mining_thread.start()
+    
+    def mine_sealed_blocks(self):
+        '''
+            This function is run on the mining thread for as long as the node lives, mining the sealed blocks in order.
+        '''
+        while True:
+            self.block_condition.acquire()
+            while not self.sealed_blocks:
+                self.block_condition.wait()
             
-            if self.active_block is not None:
-                self.active_block.failed = True
-                if self.active_block.uuid in self.active_blocks_log:
-                    del self.active_blocks_log[self.active_block.uuid]
-                self.active_block = None
-                
-            # print(f'{self.id} releasing master lock threaded_mining')
-            self.master_state_lock.release()
-            self.mining_lock.release()
-            self.mining_sem.release()
-            return
+            # * The first sealed block is always built on the last block of the chain, since the blocks are rebased whenever the chain changes
+            block = self.sealed_blocks[0]
+            block.previous_hash = self.blockchain.last_hash
+            self.mining_block = block
+            self.block_condition.release()
             
-        # print(f'{self.id} releasing master lock threaded_mining')
-        self.master_state_lock.release()
+            block.mine()
             
-        # * Only if I was created to further the current blockchain and it still hasn't changed since then, I should truly start the mining
-        self.mining_block.mine()
+            self.mining_end(block)
         
-        callback_function()
-        
-    def mining_end(self):
+    def mining_end(self, mined_block: Block):
         '''
-            This is run when a block finishes mining and does the update if successful or cleans up if it fails.
+            This is run when a block finishes mining and adds it to the blockchain if successful.
         '''
-        # print(f'{self.id} acquiring master lock mining_end')
-        self.master_state_lock.acquire()
-        # print(f'{self.id} acquired master lock mining_end')
+        self.chain_lock.acquire()
+        self.block_lock.acquire()
+        self.wallet_lock.acquire()
         
-        # print(f'{self.id}: mining end start')
         # Check that mining was successful
-        has_valid_hash = self.mining_block.validate_hash()
-        is_next_in_chain = self.blockchain.last_hash == self.mining_block.previous_hash
-        
-        if has_valid_hash and is_next_in_chain and not self.mining_block.failed:
-            # * Update blockchain
-            self.blockchain.add_block(self.mining_block)
-            self.shadow_log[self.mining_block.hash] = deepcopy(self.active_blocks_log[self.mining_block.uuid])
-            self.current_state = deepcopy(self.active_blocks_log[self.mining_block.uuid])
+        has_valid_hash = mined_block.validate_hash()
+        is_next_in_chain = self.blockchain.last_hash == mined_block.previous_hash
+        is_mined = has_valid_hash and is_next_in_chain and not mined_block.failed
+        
+        # * A failed block has already been rebased by whoever changed the chain, any other block that wasn't mined is simply mined again
+        if is_mined:
+            block_state = self.active_blocks_log.pop(mined_block.uuid)
+            self.sealed_blocks.pop(0)
+            
+            # * Update blockchain. The next sealed block was filled on top of this one, so it needs no rebase
+            self.blockchain.add_block(mined_block)
+            self.shadow_log.add(mined_block.hash, mined_block.previous_hash, block_state)
+            self.current_state = block_state.fork()
             
-            # * Use the current state to update my wallet's UTXOs
-            for _, utxo in self.current_state.utxos[self.id].items():
+            # * Update my wallet's UTXOs with the ones the block created
+            for utxo in block_state.delta().created[self.id].values():
                 self.wallet.add_transaction_output(utxo)
-            # print(f'{self.id}: added mined block broadcasting')
-            # Broadcast block
-            block_api.broadcast_block(self.mining_block, self.ring)
 
             # * Calculating metrics
             if self.started_block_counting:
@@ -615,32 +723,30 @@ class Node:
                 self.started_block_counting = True
             self.start_block_time = time()
             # * Done calculating for this block
-        else:
-            # print(f'{self.id}: mined block yeeted')
-            if self.active_block is not None:
-                self.active_block.failed = True
-                if self.active_block.uuid in self.active_blocks_log:
-                    del self.active_blocks_log[self.active_block.uuid]
-                self.active_block = None
+            
+            metrics.BLOCKS.inc('mined')
+            metrics.SEALED_BLOCKS.set(len(self.sealed_blocks))
              
-        # * Cleanup in any case 
-        del self.active_blocks_log[self.mining_block.uuid]
         self.mining_block = None
-
-        # print(f'{self.id} releasing master lock mining_end')       
-        self.master_state_lock.release()
-        self.mining_lock.release()
-        self.mining_sem.release()
         
-        # print(f'{self.id}: exited mining')
+        self.publish_snapshot()
+        self.wallet_lock.release()
+        self.block_lock.release()
+        self.chain_lock.release()
+        
+        # * The block can't change anymore, so it is sent in the background while we mine the next one. Our blocks are all sent from the
+        # * same thread, so they still reach the peers in the order they were mined
+        if is_mined:
+            broadcast.send_in_order(block_api.broadcast_block, mined_block, self.ring)
     
     def get_node_id_from_address(self, address):
         '''
             Utility function.
         '''
-        node_id = None
-        for key, node_info in self.ring.items():
-            if node_info['public_key'] == address:
-                node_id = key
-                break
-        return node_id
+        return self.ring_index.get(address)
+    
+    def update_ring_index(self):
+        '''
+            Rebuilds the public key to node id index, run every time a node joins the ring or the ring is replaced.
+        '''
+        self.ring_index = {node_info['public_key']: key for key, node_info in self.ring.items() if 'public_key' in node_info}
@@ -0,0 +1,154 @@
+from collections import OrderedDict
+
+from noobcash.state import State, StateDelta
+
+# * Every CHECKPOINT_INTERVAL-th block keeps its full state, the ones in between only keep the changes their transactions made
+CHECKPOINT_INTERVAL = 16
+
+# * How many checkpoints we keep besides the first block's one, older ones are evicted first
+MAX_CHECKPOINTS = 8
+
+# * How many recently used states are kept fully built, so that the states around the tip of the chain never need to be rebuilt
+RECENT_STATES = 8
+
+class _Entry:
+    def __init__(self, previous_hash, height, delta):
+        self.previous_hash: str = previous_hash
+        self.height: int = height
+        self.delta: StateDelta | None = delta
+
+class ShadowLog:
+    '''
+        Holds the state of every block in the blockchain, keyed by the block's hash.
+
+        Instead of a full state per block we keep the changes each block made to the state of the previous one, full states for the first block and for
+        the latest checkpoints, and a few recently used states. Any other state is rebuilt on demand by replaying the changes since the closest checkpoint before it.
+    '''
+    def __init__(self):
+        # * Insertion order is block height order since blocks are only ever added on top of the last one
+        self._entries: dict[str, _Entry] = {}
+        self._root_hash: str | None = None
+        self._root_state: State | None = None
+        self._checkpoints: OrderedDict[str, State] = OrderedDict()
+        self._recent: OrderedDict[str, State] = OrderedDict()
+
+    def __contains__(self, block_hash):
+        return block_hash in self._entries
+
+    def __getitem__(self, block_hash) -> State:
+        '''
+            Returns a fork of the state of the given block, so the caller is free to change it.
+        '''
+        if block_hash not in self._entries:
+            raise KeyError(block_hash)
+
+        state = self._get_built_state(block_hash)
+        if state is None:
+            state = self._rebuild(block_hash)
+
+        self._remember(block_hash, state)
+
+        return state.fork()
+
+    def add(self, block_hash, previous_hash, state: State):
+        '''
+            Adds the state of a block on top of the state of the previous block.
+            The given state must have been forked from the previous block's state, so that its changes since the fork are exactly the ones made by the block.
+            The first block added (or any block whose previous block is unknown) becomes the base every other state is rebuilt from.
+        '''
+        if previous_hash not in self._entries:
+            self._entries.clear()
+            self._checkpoints.clear()
+            self._recent.clear()
+            self._root_hash = block_hash
+            self._root_state = state.fork()
+            self._entries[block_hash] = _Entry(previous_hash, 0, None)
+            return self
+
+        return self._insert(block_hash, previous_hash, state.delta(), state.fork())
+
+    def truncate(self, block_hash):
+        '''
+            Forgets every block after the given one, as happens when our chain loses a consensus after that block.
+        '''
+        height = self._entries[block_hash].height
+
+        while self._entries:
+            last_hash = next(reversed(self._entries))
+            if self._entries[last_hash].height <= height:
+                break
+
+            del self._entries[last_hash]
+            self._checkpoints.pop(last_hash, None)
+            self._recent.pop(last_hash, None)
+
+        return self
+
+    def to_dict(self):
+        return {
+            'root_hash': self._root_hash,
+            'root_state': self._root_state.to_dict() if self._root_state is not None else None,
+            'entries': [{'hash': block_hash, 'previous_hash': entry.previous_hash, 'delta': entry.delta.to_dict()}
+                        for block_hash, entry in self._entries.items() if entry.delta is not None]
+        }
+
+    @classmethod
+    def from_dictionary(cls, dictionary):
+        shadow_log = cls()
+
+        if dictionary['root_hash'] is None:
+            return shadow_log
+
+        root_state = State.from_dictionary(dictionary['root_state'])
+        shadow_log.add(dictionary['root_hash'], None, root_state)
+
+        for entry_dict in dictionary['entries']:
+            shadow_log._insert(entry_dict['hash'], entry_dict['previous_hash'], StateDelta.from_dictionary(entry_dict['delta']))
+
+        return shadow_log
+
+    def _insert(self, block_hash, previous_hash, delta: StateDelta, state: State = None):
+        height = self._entries[previous_hash].height + 1
+        self._entries[block_hash] = _Entry(previous_hash, height, delta)
+
+        if height % CHECKPOINT_INTERVAL == 0:
+            self._checkpoints[block_hash] = state if state is not None else self._rebuild(block_hash)
+            if len(self._checkpoints) > MAX_CHECKPOINTS:
+                self._checkpoints.popitem(last=False)
+
+        if state is not None:
+            self._remember(block_hash, state)
+
+        return self
+
+    def _get_built_state(self, block_hash):
+        if block_hash in self._recent:
+            return self._recent[block_hash]
+        if block_hash in self._checkpoints:
+            return self._checkpoints[block_hash]
+        if block_hash == self._root_hash:
+            return self._root_state
+
+        return None
+
+    def _rebuild(self, block_hash):
+        # * Walk back to the closest block whose state we have and replay the changes of every block after it
+        deltas = []
+        state = None
+        while state is None:
+            entry = self._entries[block_hash]
+            deltas.append(entry.delta)
+            block_hash = entry.previous_hash
+            state = self._get_built_state(block_hash)
+
+        state = state.fork()
+        for delta in reversed(deltas):
+            state.apply(delta)
+
+        return state
+
+    def _remember(self, block_hash, state: State):
+        self._recent[block_hash] = state
+        self._recent.move_to_end(block_hash)
+        if len(self._recent) > RECENT_STATES:
+            self._recent.popitem(last=False)
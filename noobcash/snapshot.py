@@ -0,0 +1,15 @@
+from noobcash.block import Block
+from noobcash.state import State
+from noobcash.transaction_output import TransactionOutput
+
+class Snapshot:
+    '''
+        What the read endpoints need to know about the node at one point in time, so that they can be served without taking any lock.
+        A snapshot is never changed after it is published, the node publishes a new one instead.
+    '''
+    def __init__(self, chain, current_state, wallet_utxos, wallet_stxos, balance):
+        self.chain: tuple[Block, ...] = chain
+        self.current_state: State = current_state
+        self.wallet_utxos: tuple[TransactionOutput, ...] = wallet_utxos
+        self.wallet_stxos: tuple[str, ...] = wallet_stxos
+        self.balance = balance
@@ -1,37 +1,306 @@
-from copy import deepcopy
+from collections.abc import Mapping, MutableMapping, Set
 
 from noobcash.transaction_output import TransactionOutput
 
 class State:
+    '''
+        Copy-on-write view of the UTXOs of every node and of the transactions processed so far.
+
+        A state is a stack of frozen layers, each holding the changes made on top of the one below it, plus a private layer that takes every write.
+        Forking freezes the private layer and hands out a new state on top of it, so both the original and the fork share everything up to that point
+        and forking costs as much as the changes since the last fork, not the whole history.
+
+        Every state also keeps the changes made to it since it was forked, which is what the shadow log stores for each block.
+    '''
     def __init__(self, utxos, processed_transactions):
-        self.utxos: dict[str, dict[str, TransactionOutput]] = deepcopy(utxos)
-        self.processed_transactions: set[str] = deepcopy(processed_transactions)
-        
+        self.node_ids: tuple[str, ...] = tuple(utxos.keys())
+        self._base: _Layer = _Layer(None, {key: dict(utxo_dict) for key, utxo_dict in utxos.items()}, {key: set() for key in self.node_ids}, set(processed_transactions))
+        self._reset_changes()
+        self._delta = StateDelta.empty(self.node_ids)
+
+    @property
+    def utxos(self) -> Mapping[str, MutableMapping[str, TransactionOutput]]:
+        return _Utxos(self)
+
+    @property
+    def processed_transactions(self) -> Set[str]:
+        return _ProcessedTransactions(self)
+
+    def fork(self):
+        '''
+            Returns a state equal to this one that can be changed independently of it.
+        '''
+        self._freeze()
+
+        forked_state = State.__new__(State)
+        forked_state.node_ids = self.node_ids
+        forked_state._base = self._base
+        forked_state._reset_changes()
+        forked_state._delta = StateDelta.empty(self.node_ids)
+
+        return forked_state
+
+    def delta(self):
+        '''
+            Returns the changes made to this state since it was forked.
+        '''
+        return self._delta.copy()
+
+    def apply(self, delta):
+        for key, utxo_ids in delta.spent.items():
+            for utxo_id in utxo_ids:
+                del self.utxos[key][utxo_id]
+
+        for key, utxo_dict in delta.created.items():
+            for utxo_id, utxo in utxo_dict.items():
+                self.utxos[key][utxo_id] = utxo
+
+        for transaction_id in delta.processed_transactions:
+            self.processed_transactions.add(transaction_id)
+
     def to_dict(self):
         return {
-            'utxos': State.utxos_to_dict(self.utxos),
+            'utxos': State.utxos_to_dict(self._materialize_utxos()),
             'processed_transactions': list(self.processed_transactions)
         }
-        
+
     @classmethod
     def from_dictionary(cls, dictionary):
         utxos = State.utxos_from_dict(dictionary['utxos'])
         processed_transactions = set(dictionary['processed_transactions'])
-        
+
         return cls(utxos, processed_transactions)
-    
+
     @staticmethod
     def utxos_to_dict(utxos: dict):
-        utxos_copy = deepcopy(utxos)
-        
-        for key, utxo_dict in utxos.items():
-            utxos_copy[key] = {utxo_id: utxo.to_dict() for utxo_id, utxo in utxo_dict.items()}
-            
-        return utxos_copy
-        
+        return {key: {utxo_id: utxo.to_dict() for utxo_id, utxo in utxo_dict.items()} for key, utxo_dict in utxos.items()}
+
     @staticmethod
     def utxos_from_dict(utxos: dict[str, dict[str, dict]]) -> dict[str, dict[str, TransactionOutput]]:
         for key, utxo_dict in utxos.items():
             utxos[key] = {utxo_id: TransactionOutput.from_dictionary(utxo) for utxo_id, utxo in utxo_dict.items()}
-            
-        return utxos
\ No newline at end of file
+
+        return utxos
+
+    def _reset_changes(self):
+        self._utxos: dict[str, dict[str, TransactionOutput]] = {key: {} for key in self.node_ids}
+        self._spent: dict[str, set[str]] = {key: set() for key in self.node_ids}
+        self._processed_transactions: set[str] = set()
+
+    def _freeze(self):
+        if not any(self._utxos.values()) and not any(self._spent.values()) and not self._processed_transactions:
+            return
+
+        self._base = _Layer(self._base, self._utxos, self._spent, self._processed_transactions).compacted()
+        self._reset_changes()
+
+    def _layers(self):
+        '''
+            Yields every layer from the newest (the private one) to the oldest.
+        '''
+        yield self._utxos, self._spent, self._processed_transactions
+
+        layer = self._base
+        while layer is not None:
+            yield layer.utxos, layer.spent, layer.processed_transactions
+            layer = layer.parent
+
+    def _get_utxo(self, node_id, utxo_id):
+        self._check_node_id(node_id)
+
+        for utxos, spent, _ in self._layers():
+            if utxo_id in utxos[node_id]:
+                return utxos[node_id][utxo_id]
+            if utxo_id in spent[node_id]:
+                break
+
+        raise KeyError(utxo_id)
+
+    def _set_utxo(self, node_id, utxo_id, utxo: TransactionOutput):
+        self._check_node_id(node_id)
+
+        # * Overwriting a utxo that existed before the fork counts as spending it and creating a new one
+        if utxo_id not in self._delta.created[node_id] and self._has_utxo(node_id, utxo_id):
+            self._delta.spent[node_id].add(utxo_id)
+        self._delta.created[node_id][utxo_id] = utxo
+
+        self._spent[node_id].discard(utxo_id)
+        self._utxos[node_id][utxo_id] = utxo
+
+    def _del_utxo(self, node_id, utxo_id):
+        # * Raises KeyError if the utxo does not exist, like deleting from a dict would
+        self._get_utxo(node_id, utxo_id)
+
+        if utxo_id in self._delta.created[node_id]:
+            del self._delta.created[node_id][utxo_id]
+        else:
+            self._delta.spent[node_id].add(utxo_id)
+
+        self._utxos[node_id].pop(utxo_id, None)
+        self._spent[node_id].add(utxo_id)
+
+    def _has_utxo(self, node_id, utxo_id):
+        try:
+            self._get_utxo(node_id, utxo_id)
+        except KeyError:
+            return False
+
+        return True
+
+    def _materialize_node_utxos(self, node_id):
+        self._check_node_id(node_id)
+
+        node_utxos = {}
+        for utxos, spent, _ in reversed(list(self._layers())):
+            for utxo_id in spent[node_id]:
+                node_utxos.pop(utxo_id, None)
+            node_utxos.update(utxos[node_id])
+
+        return node_utxos
+
+    def _materialize_utxos(self):
+        return {key: self._materialize_node_utxos(key) for key in self.node_ids}
+
+    def _has_processed(self, transaction_id):
+        return any(transaction_id in processed_transactions for _, _, processed_transactions in self._layers())
+
+    def _materialize_processed(self):
+        processed = set()
+        for _, _, processed_transactions in self._layers():
+            processed |= processed_transactions
+
+        return processed
+
+    def _check_node_id(self, node_id):
+        if node_id not in self.node_ids:
+            raise KeyError(node_id)
+
+class StateDelta:
+    '''
+        The changes that turn one state into another: the utxos that were spent, the utxos that were created and the transactions that were processed.
+    '''
+    def __init__(self, spent, created, processed_transactions):
+        self.spent: dict[str, set[str]] = spent
+        self.created: dict[str, dict[str, TransactionOutput]] = created
+        self.processed_transactions: set[str] = processed_transactions
+
+    @classmethod
+    def empty(cls, node_ids):
+        return cls({key: set() for key in node_ids}, {key: {} for key in node_ids}, set())
+
+    def copy(self):
+        return StateDelta({key: set(utxo_ids) for key, utxo_ids in self.spent.items()},
+                          {key: dict(utxo_dict) for key, utxo_dict in self.created.items()},
+                          set(self.processed_transactions))
+
+    def to_dict(self):
+        return {
+            'spent': {key: list(utxo_ids) for key, utxo_ids in self.spent.items()},
+            'created': State.utxos_to_dict(self.created),
+            'processed_transactions': list(self.processed_transactions)
+        }
+
+    @classmethod
+    def from_dictionary(cls, dictionary):
+        spent = {key: set(utxo_ids) for key, utxo_ids in dictionary['spent'].items()}
+        created = State.utxos_from_dict(dictionary['created'])
+        processed_transactions = set(dictionary['processed_transactions'])
+
+        return cls(spent, created, processed_transactions)
+
+class _Layer:
+    '''
+        Frozen changes on top of a parent layer. Layers are shared between states and must never be modified after creation.
+    '''
+    def __init__(self, parent, utxos, spent, processed_transactions):
+        self.parent: _Layer | None = parent
+        self.utxos: dict[str, dict[str, TransactionOutput]] = utxos
+        self.spent: dict[str, set[str]] = spent
+        self.processed_transactions: set[str] = processed_transactions
+        self.size = sum(map(len, utxos.values())) + sum(map(len, spent.values())) + len(processed_transactions)
+
+    def compacted(self):
+        '''
+            Merges this layer with its parents for as long as it is at least as big as them, much like carrying in a binary counter.
+            This keeps the number of layers logarithmic in the size of the history and every change gets copied a logarithmic number of times.
+        '''
+        layer = self
+        while layer.parent is not None and layer.parent.size <= layer.size:
+            layer = layer.parent.merged_with(layer)
+
+        return layer
+
+    def merged_with(self, upper):
+        # * Utxos spent in the upper layer only need to be remembered if there is a parent layer that can still contain them
+        keep_spent = self.parent is not None
+
+        utxos = {}
+        spent = {}
+        for key in self.utxos:
+            utxos[key] = {utxo_id: utxo for utxo_id, utxo in self.utxos[key].items() if utxo_id not in upper.spent[key]}
+            utxos[key].update(upper.utxos[key])
+
+            spent[key] = (self.spent[key] | upper.spent[key]) - upper.utxos[key].keys() if keep_spent else set()
+
+        return _Layer(self.parent, utxos, spent, self.processed_transactions | upper.processed_transactions)
+
+class _Utxos(Mapping):
+    def __init__(self, state: State):
+        self._state = state
+
+    def __getitem__(self, node_id):
+        self._state._check_node_id(node_id)
+
+        return _NodeUtxos(self._state, node_id)
+
+    def __iter__(self):
+        return iter(self._state.node_ids)
+
+    def __len__(self):
+        return len(self._state.node_ids)
+
+class _NodeUtxos(MutableMapping):
+    def __init__(self, state: State, node_id):
+        self._state = state
+        self._node_id = node_id
+
+    def __getitem__(self, utxo_id):
+        return self._state._get_utxo(self._node_id, utxo_id)
+
+    def __setitem__(self, utxo_id, utxo):
+        self._state._set_utxo(self._node_id, utxo_id, utxo)
+
+    def __delitem__(self, utxo_id):
+        self._state._del_utxo(self._node_id, utxo_id)
+
+    def __iter__(self):
+        return iter(self._state._materialize_node_utxos(self._node_id))
+
+    def __len__(self):
+        return len(self._state._materialize_node_utxos(self._node_id))
+
+    def items(self):
+        return self._state._materialize_node_utxos(self._node_id).items()
+
+    def values(self):
+        return self._state._materialize_node_utxos(self._node_id).values()
+
+class _ProcessedTransactions(Set):
+    def __init__(self, state: State):
+        self._state = state
+
+    def __contains__(self, transaction_id):
+        return self._state._has_processed(transaction_id)
+
+    def __iter__(self):
+        return iter(self._state._materialize_processed())
+
+    def __len__(self):
+        return len(self._state._materialize_processed())
+
+    def add(self, transaction_id):
+        if transaction_id in self:
+            return
+
+        self._state._delta.processed_transactions.add(transaction_id)
+        self._state._processed_transactions.add(transaction_id)
@@ -1,7 +1,10 @@
 import base64
 from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
 
 import binascii
+import sys
 from email.mime import base
 import uuid
 
@@ -16,7 +19,43 @@ from noobcash.exceptions import InsufficientFundsException, NegativeAmountExcept
 from noobcash.transaction_input import TransactionInput
 from noobcash.transaction_output import TransactionOutput
 
+# * How many parsed public keys we keep, there is one per node in the ring (plus the genesis sender)
+KEY_CACHE_SIZE = 64
+
+# * How many verified signatures we remember, enough to cover every transaction that can be pending or in a consensus at the same time
+SIGNATURE_CACHE_SIZE = 65536
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def import_public_key(public_key: str):
+    return RSA.import_key(public_key)
+
+class VerifiedSignatures:
+    '''
+        Bounded set of (transaction_id, signature) pairs that have already passed RSA verification, evicting the least recently used first.
+    '''
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.lock = Lock()
+        self.signatures: OrderedDict[tuple[str, str], None] = OrderedDict()
+        
+    def __contains__(self, key):
+        with self.lock:
+            if key not in self.signatures:
+                return False
+            self.signatures.move_to_end(key)
+            return True
+        
+    def add(self, key):
+        with self.lock:
+            self.signatures[key] = None
+            self.signatures.move_to_end(key)
+            if len(self.signatures) > self.maxsize:
+                self.signatures.popitem(last=False)
+
+verified_signatures = VerifiedSignatures(SIGNATURE_CACHE_SIZE)
+
 class Transaction:
+    __slots__ = ('sender_address', 'recipient_address', 'amount', 'transaction_inputs', 'transaction_id', 'transaction_outputs', 'signature')
 
     def __init__(self, sender_address, recipient_address, amount, transaction_inputs, transaction_id=None, signature=None, transaction_outputs=None):
         #self.sender_address: To public key του wallet από το οποίο προέρχονται τα χρήματα
@@ -28,8 +67,9 @@ class Transaction:
         #selfSignature
         
         # Basic info: Who sends to whom and how much money (addresses are public keys)
-        self.sender_address: str = sender_address
-        self.recipient_address: str = recipient_address
+        # * Interned, so that the transactions of the same nodes share a single copy of their keys
+        self.sender_address: str = sys.intern(sender_address)
+        self.recipient_address: str = sys.intern(recipient_address)
         self.amount = amount
         self.transaction_inputs: list[TransactionInput] = transaction_inputs
         
@@ -122,6 +162,17 @@ class Transaction:
         # 2) Check that the sender is really the one who sent me the transaction
         new_hash = base64.b64encode(self.hash_function()).decode('utf-8')
         check_1 = self.transaction_id == new_hash
-        check_2 = PKCS1_v1_5.new(RSA.import_key(self.sender_address)).verify(SHA256.new(base64.b64decode(self.transaction_id)), base64.b64decode(self.signature))
-        return check_1 and check_2
+        if not check_1:
+            return False
+        
+        # * The id covers the sender's key, so once the id checks out a signature that was valid for it is valid for this transaction too
+        signature_key = (self.transaction_id, self.signature)
+        if signature_key in verified_signatures:
+            return True
+        
+        check_2 = PKCS1_v1_5.new(import_public_key(self.sender_address)).verify(SHA256.new(base64.b64decode(self.transaction_id)), base64.b64decode(self.signature))
+        if check_2:
+            verified_signatures.add(signature_key)
+            
+        return check_2
 
@@ -2,6 +2,8 @@ import base64
 from noobcash.transaction_output import TransactionOutput
 
 class TransactionInput(TransactionOutput):
+    __slots__ = ()
+    
     def __init__(self, transaction_output: TransactionOutput) -> None:
         # public key of recipient
         self.recipient = transaction_output.recipient
@@ -1,10 +1,14 @@
 import base64
+import sys
 from Crypto.Hash import SHA256
 
 class TransactionOutput:
+    # * Every state holds a lot of these, so they don't get an instance dict
+    __slots__ = ('recipient', 'value', 'parent_transaction_id', 'id')
+    
     def __init__(self, recipient_public_key, value, parent_transaction_id, trans_id=None) -> None:        
-        # public key of recipient
-        self.recipient = recipient_public_key
+        # public key of recipient, interned so that all the outputs of a node share a single copy of its key
+        self.recipient = sys.intern(recipient_public_key)
         
         # coupon amount
         self.value = value
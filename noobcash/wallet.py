@@ -17,23 +17,46 @@ from noobcash.transaction_output import TransactionOutput
 
 class Wallet:
     def __init__(self):
-        # Generate a key pair and create an empty UTXO list (wallet hasn't participated in any transactions)
+        # Generate a key pair and create an empty UTXO set (wallet hasn't participated in any transactions)
         keys = Crypto.PublicKey.RSA.generate(2048)
         
         self.public_key = keys.public_key().export_key()
         self.private_key = keys.export_key()
-        self.UTXOs: list[TransactionOutput] = []
+        self.UTXOs: dict[str, TransactionOutput] = {}
         self.STXOs: set = set()
+        
+        # * Kept up to date on every change so that the balance never needs to add up the UTXOs
+        self.total = 0
 
     def balance(self):  
         # Return the balance of the wallet
-        # Works because UTXOs list contains transaction outputs with __radd__ method
-        return sum(self.UTXOs)
+        return self.total
 
     def add_transaction_output(self, transaction_output: TransactionOutput):
-        if transaction_output.id not in self.STXOs and transaction_output.id not in [utxo.id for utxo in self.UTXOs]:
-            self.UTXOs.append(transaction_output)
+        if transaction_output.id not in self.STXOs and transaction_output.id not in self.UTXOs:
+            self.UTXOs[transaction_output.id] = transaction_output
+            self.total += transaction_output.value
+            
+    def spend(self, transaction_outputs: list[TransactionOutput]):
+        for transaction_output in transaction_outputs:
+            if self.UTXOs.pop(transaction_output.id, None) is not None:
+                self.total -= transaction_output.value
+            self.STXOs.add(transaction_output.id)
+            
+    def select_coins(self, amount):
+        '''
+            Picks the UTXOs to spend for the given amount, largest first, which needs the fewest of them.
+            If they are not enough returns all of them and lets the transaction find out.
+        '''
+        selected = []
+        selected_total = 0
+        for utxo in sorted(self.UTXOs.values(), key=lambda utxo: utxo.value, reverse=True):
+            if selected_total >= amount and selected:
+                break
+            selected.append(utxo)
+            selected_total += utxo.value
+            
+        return selected
 
     def get_key_pair(self):
         return (self.public_key, self.private_key)
-        
\ No newline at end of file
@@ -0,0 +1,231 @@
+'''
+    Compact binary encoding of transactions, blocks and blockchains, used instead of JSON when both sides agree on it through the content type.
+
+    Every payload starts with the format version and the kind of object it holds. Ids and hashes are sent as their raw 32 bytes instead of base64,
+    amounts as doubles, and public keys as the id of their node in the ring (keys that are not in the ring, like the genesis sender's, are sent whole).
+'''
+import base64
+import struct
+
+from noobcash.block import Block
+from noobcash.blockchain import Blockchain
+from noobcash.exceptions import InsufficientFundsException, NegativeAmountException
+from noobcash.transaction import Transaction
+from noobcash.transaction_input import TransactionInput
+from noobcash.transaction_output import TransactionOutput
+
+CONTENT_TYPE = 'application/x-noobcash'
+FORMAT_VERSION = 1
+
+TRANSACTIONS = 1
+BLOCK = 2
+BLOCKCHAIN = 3
+
+# * How an address is sent
+NODE_ID = 0
+PUBLIC_KEY = 1
+
+class Writer:
+    def __init__(self, ring_index):
+        self.ring_index: dict[str, str] = ring_index
+        self.buffer = bytearray()
+
+    def pack(self, fmt, *values):
+        self.buffer += struct.pack(fmt, *values)
+
+    def bytes(self, value: bytes):
+        self.pack('!I', len(value))
+        self.buffer += value
+
+    def string(self, value: str):
+        self.bytes(value.encode('utf-8'))
+
+    def optional_string(self, value):
+        self.pack('!?', value is not None)
+        if value is not None:
+            self.string(value)
+
+    def signature(self, value):
+        # * Signatures are base64 encoded too, the genesis transaction has none
+        self.pack('!?', value is not None)
+        if value is not None:
+            self.bytes(base64.b64decode(value))
+
+    def digest(self, value: str):
+        # * Ids and hashes are base64 encoded SHA256 digests
+        self.buffer += base64.b64decode(value)
+
+    def address(self, value: str):
+        node_id = self.ring_index.get(value)
+        if node_id is not None:
+            self.pack('!B', NODE_ID)
+            self.string(node_id)
+        else:
+            self.pack('!B', PUBLIC_KEY)
+            self.string(value)
+
+    def transaction_output(self, transaction_output: TransactionOutput):
+        self.address(transaction_output.recipient)
+        self.pack('!d', transaction_output.value)
+        self.digest(transaction_output.parent_transaction_id)
+        self.digest(transaction_output.id)
+
+    def transaction(self, transaction: Transaction):
+        self.address(transaction.sender_address)
+        self.address(transaction.recipient_address)
+        self.pack('!d', transaction.amount)
+        self.digest(transaction.transaction_id)
+        self.signature(transaction.signature)
+
+        self.pack('!I', len(transaction.transaction_inputs))
+        for transaction_input in transaction.transaction_inputs:
+            self.transaction_output(transaction_input)
+
+        self.pack('!I', len(transaction.transaction_outputs))
+        for transaction_output in transaction.transaction_outputs:
+            self.transaction_output(transaction_output)
+
+    def block(self, block: Block):
+        self.digest(block.previous_hash)
+        self.string(block.timestamp)
+        self.digest(block.hash)
+        self.pack('!Q', block.nonce)
+
+        self.pack('!I', len(block.list_of_transactions))
+        for transaction in block.list_of_transactions:
+            self.transaction(transaction)
+
+    def blockchain(self, blockchain: Blockchain):
+        self.optional_string(blockchain.last_hash)
+
+        self.pack('!I', len(blockchain.chain))
+        for block in blockchain.chain:
+            self.block(block)
+
+class Reader:
+    def __init__(self, data: bytes, ring):
+        self.ring: dict[str, dict] = ring
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+
+        return values[0] if len(values) == 1 else values
+
+    def take(self, length):
+        if self.offset + length > len(self.data):
+            raise ValueError('Payload is truncated')
+
+        value = bytes(self.data[self.offset:self.offset + length])
+        self.offset += length
+
+        return value
+
+    def bytes(self):
+        return self.take(self.unpack('!I'))
+
+    def string(self):
+        return self.bytes().decode('utf-8')
+
+    def optional_string(self):
+        return self.string() if self.unpack('!?') else None
+
+    def signature(self):
+        return base64.b64encode(self.bytes()).decode('utf-8') if self.unpack('!?') else None
+
+    def digest(self):
+        return base64.b64encode(self.take(32)).decode('utf-8')
+
+    def address(self):
+        kind = self.unpack('!B')
+        if kind == PUBLIC_KEY:
+            return self.string()
+
+        node_id = self.string()
+        if kind != NODE_ID or node_id not in self.ring:
+            raise ValueError(f'Unknown address {node_id}')
+
+        # * A node that has registered may not have a public key in our ring yet
+        public_key = self.ring[node_id].get('public_key')
+        if public_key is None:
+            raise ValueError(f'Unknown public key of node {node_id}')
+
+        return public_key
+
+    def transaction_output(self):
+        recipient = self.address()
+        value = self.unpack('!d')
+        parent_transaction_id = self.digest()
+        trans_id = self.digest()
+
+        return TransactionOutput(recipient, value, parent_transaction_id, trans_id)
+
+    def transaction(self):
+        sender_address = self.address()
+        recipient_address = self.address()
+        amount = self.unpack('!d')
+        transaction_id = self.digest()
+        signature = self.signature()
+        transaction_inputs = [TransactionInput(self.transaction_output()) for _ in range(self.unpack('!I'))]
+        transaction_outputs = [self.transaction_output() for _ in range(self.unpack('!I'))]
+
+        return Transaction(sender_address, recipient_address, amount, transaction_inputs, transaction_id, signature, transaction_outputs)
+
+    def block(self):
+        previous_hash = self.digest()
+        timestamp = self.string()
+        my_hash = self.digest()
+        nonce = self.unpack('!Q')
+        list_of_transactions = [self.transaction() for _ in range(self.unpack('!I'))]
+
+        return Block(previous_hash, timestamp, my_hash, nonce, list_of_transactions)
+
+    def blockchain(self):
+        last_hash = self.optional_string()
+        chain = [self.block() for _ in range(self.unpack('!I'))]
+
+        return Blockchain(chain, last_hash)
+
+def dumps(kind, obj, ring_index):
+    writer = Writer(ring_index)
+    writer.pack('!BB', FORMAT_VERSION, kind)
+
+    if kind == TRANSACTIONS:
+        writer.pack('!I', len(obj))
+        for transaction in obj:
+            writer.transaction(transaction)
+    elif kind == BLOCK:
+        writer.block(obj)
+    elif kind == BLOCKCHAIN:
+        writer.blockchain(obj)
+
+    return bytes(writer.buffer)
+
+def loads(kind, data, ring):
+    '''
+        Raises ValueError if the payload is not a valid payload of the expected kind.
+    '''
+    reader = Reader(data, ring)
+
+    try:
+        version, payload_kind = reader.unpack('!BB')
+        if version != FORMAT_VERSION or payload_kind != kind:
+            raise ValueError(f'Unexpected payload version {version} or kind {payload_kind}')
+
+        if kind == TRANSACTIONS:
+            obj = [reader.transaction() for _ in range(reader.unpack('!I'))]
+        elif kind == BLOCK:
+            obj = reader.block()
+        else:
+            obj = reader.blockchain()
+    except struct.error as e:
+        raise ValueError('Payload is truncated') from e
+    except (InsufficientFundsException, NegativeAmountException) as e:
+        raise ValueError(f'Invalid transaction: {e}') from e
+
+    if reader.offset != len(reader.data):
+        raise ValueError('Unexpected data after the payload')
+
+    return obj
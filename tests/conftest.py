@@ -0,0 +1,6 @@
+import os
+
+# * The noobcash package reads these when it is imported, the tests don't depend on their values but they must be set
+os.environ.setdefault('CAPACITY', '5')
+os.environ.setdefault('DIFFICULTY', '4')
+os.environ.setdefault('NODE_NUM', '3')
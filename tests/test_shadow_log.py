@@ -0,0 +1,101 @@
+import json
+import random
+
+from noobcash import shadow_log
+from noobcash.shadow_log import ShadowLog
+from noobcash.state import State
+
+from tests.test_state import NODE_IDS, as_plain, make_id, make_utxo
+
+# * Enough blocks for the oldest checkpoints to be evicted, so that some states can only be rebuilt from the first block
+BLOCKS = shadow_log.CHECKPOINT_INTERVAL * (shadow_log.MAX_CHECKPOINTS + 3)
+
+def build_chain(log: ShadowLog, previous_hash, state: State, blocks, rnd: random.Random, prefix):
+    '''
+        Adds `blocks` blocks with random changes on top of the given block, the way the node adds them. Returns their hashes and the expected contents
+        of their states.
+    '''
+    hashes = []
+    expected = {}
+    for height in range(blocks):
+        state = state.fork()
+        for _ in range(rnd.randint(0, 4)):
+            node_id = rnd.choice(NODE_IDS)
+            node_utxos = sorted(state.utxos[node_id])
+            if node_utxos and rnd.random() < 0.5:
+                del state.utxos[node_id][rnd.choice(node_utxos)]
+            else:
+                utxo = make_utxo(f'{prefix} {height} {rnd.random()}', node_id, rnd.randint(1, 100))
+                state.utxos[node_id][utxo.id] = utxo
+        state.processed_transactions.add(make_id(f'{prefix} transaction {height}'))
+
+        block_hash = make_id(f'{prefix} block {height}')
+        log.add(block_hash, previous_hash, state)
+        hashes.append(block_hash)
+        expected[block_hash] = as_plain(state)
+        previous_hash = block_hash
+
+    return hashes, expected
+
+def new_log(rnd):
+    genesis_utxo = make_utxo('genesis', '0', 100)
+    genesis_state = State({node_id: {} for node_id in NODE_IDS}, ['genesis'])
+    genesis_state.utxos['0'][genesis_utxo.id] = genesis_utxo
+
+    log = ShadowLog()
+    genesis_hash = make_id('genesis block')
+    log.add(genesis_hash, make_id('nothing'), genesis_state)
+
+    hashes, expected = build_chain(log, genesis_hash, genesis_state, BLOCKS, rnd, 'main')
+
+    return log, [genesis_hash] + hashes, {genesis_hash: as_plain(genesis_state), **expected}
+
+def check_states(log, hashes, expected, rnd):
+    # * In random order, so that most states are neither cached nor a checkpoint and have to be rebuilt
+    for block_hash in rnd.sample(hashes, len(hashes)):
+        assert block_hash in log
+        assert as_plain(log[block_hash]) == expected[block_hash]
+
+def test_every_state_is_rebuilt():
+    rnd = random.Random(1)
+    log, hashes, expected = new_log(rnd)
+
+    check_states(log, hashes, expected, rnd)
+
+def test_returned_states_are_forks():
+    rnd = random.Random(2)
+    log, hashes, expected = new_log(rnd)
+
+    state = log[hashes[-1]]
+    for node_id in NODE_IDS:
+        for utxo_id in list(state.utxos[node_id]):
+            del state.utxos[node_id][utxo_id]
+
+    assert as_plain(log[hashes[-1]]) == expected[hashes[-1]]
+
+def test_truncate_forgets_later_blocks_and_accepts_a_new_branch():
+    rnd = random.Random(3)
+    log, hashes, expected = new_log(rnd)
+
+    fork_height = BLOCKS // 2 + 3
+    log.truncate(hashes[fork_height])
+
+    for block_hash in hashes[fork_height + 1:]:
+        assert block_hash not in log
+    check_states(log, hashes[:fork_height + 1], expected, rnd)
+
+    # * The winning branch goes on from the fork point, past the height the old chain had
+    branch, branch_expected = build_chain(log, hashes[fork_height], log[hashes[fork_height]], BLOCKS, rnd, 'branch')
+
+    check_states(log, hashes[:fork_height + 1] + branch, {**expected, **branch_expected}, rnd)
+
+def test_dictionary_round_trip():
+    rnd = random.Random(4)
+    log, hashes, expected = new_log(rnd)
+
+    # * Through JSON, the way it is sent to new nodes
+    copy = ShadowLog.from_dictionary(json.loads(json.dumps(log.to_dict())))
+
+    check_states(copy, hashes, expected, rnd)
+
+    assert ShadowLog.from_dictionary(ShadowLog().to_dict())._entries == {}
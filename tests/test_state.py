@@ -0,0 +1,137 @@
+import base64
+import hashlib
+import random
+
+import pytest
+
+from noobcash.state import State
+from noobcash.transaction_output import TransactionOutput
+
+NODE_IDS = ('0', '1', '2')
+
+def make_id(seed):
+    return base64.b64encode(hashlib.sha256(str(seed).encode()).digest()).decode('utf-8')
+
+def make_utxo(seed, node_id, value):
+    return TransactionOutput(f'PK{node_id}', value, make_id(f'parent {seed}'), make_id(seed))
+
+def as_plain(state: State):
+    '''
+        The contents of a state as plain dicts and sets, to compare with the model.
+    '''
+    utxos = {node_id: {utxo_id: (utxo.recipient, utxo.value, utxo.parent_transaction_id) for utxo_id, utxo in state.utxos[node_id].items()} for node_id in NODE_IDS}
+
+    return utxos, set(state.processed_transactions)
+
+def model_of(utxos, processed):
+    return {node_id: {utxo_id: (utxo.recipient, utxo.value, utxo.parent_transaction_id) for utxo_id, utxo in node_utxos.items()}
+            for node_id, node_utxos in utxos.items()}, set(processed)
+
+def apply_to_model(model, delta):
+    utxos, processed = model
+    utxos = {node_id: dict(node_utxos) for node_id, node_utxos in utxos.items()}
+    for node_id, utxo_ids in delta.spent.items():
+        for utxo_id in utxo_ids:
+            del utxos[node_id][utxo_id]
+    for node_id, node_utxos in delta.created.items():
+        for utxo_id, utxo in node_utxos.items():
+            utxos[node_id][utxo_id] = (utxo.recipient, utxo.value, utxo.parent_transaction_id)
+
+    return utxos, processed | delta.processed_transactions
+
+def check(state, utxos, processed, base_model):
+    assert as_plain(state) == model_of(utxos, processed)
+
+    # * The point lookups must agree with the materialized view too
+    for node_id in NODE_IDS:
+        for utxo_id, utxo in utxos[node_id].items():
+            assert state.utxos[node_id][utxo_id] is utxo
+        assert len(state.utxos[node_id]) == len(utxos[node_id])
+    for transaction_id in processed:
+        assert transaction_id in state.processed_transactions
+
+    # * Replaying the changes since the fork on the state it was forked from gives the current state
+    assert apply_to_model(base_model, state.delta()) == model_of(utxos, processed)
+
+@pytest.mark.parametrize('seed', range(20))
+def test_fork_and_mutate_matches_dict_model(seed):
+    rnd = random.Random(seed)
+
+    initial = {node_id: {} for node_id in NODE_IDS}
+    for i in range(5):
+        utxo = make_utxo(f'initial {i}', NODE_IDS[i % len(NODE_IDS)], i + 1)
+        initial[NODE_IDS[i % len(NODE_IDS)]][utxo.id] = utxo
+
+    # * Every state next to the plain dicts it must be equal to, and the model of the state it was forked from
+    initial_utxos = {node_id: dict(node_utxos) for node_id, node_utxos in initial.items()}
+    states = [(State(initial, ['genesis']), initial_utxos, {'genesis'}, model_of(initial_utxos, {'genesis'}))]
+
+    counter = 0
+    for _ in range(400):
+        index = rnd.randrange(len(states))
+        state, utxos, processed, base_model = states[index]
+        operation = rnd.random()
+        node_id = rnd.choice(NODE_IDS)
+        counter += 1
+
+        if operation < 0.15:
+            forked = state.fork()
+            forked_utxos = {key: dict(node_utxos) for key, node_utxos in utxos.items()}
+            states.append((forked, forked_utxos, set(processed), model_of(forked_utxos, processed)))
+            continue
+
+        if operation < 0.45:
+            utxo = make_utxo(counter, node_id, rnd.randint(1, 100))
+            state.utxos[node_id][utxo.id] = utxo
+            utxos[node_id][utxo.id] = utxo
+        elif operation < 0.55 and utxos[node_id]:
+            # * Overwriting an existing utxo
+            utxo_id = rnd.choice(sorted(utxos[node_id]))
+            utxo = TransactionOutput(f'PK{node_id}', rnd.randint(1, 100), make_id(f'parent {counter}'), utxo_id)
+            state.utxos[node_id][utxo_id] = utxo
+            utxos[node_id][utxo_id] = utxo
+        elif operation < 0.85 and utxos[node_id]:
+            utxo_id = rnd.choice(sorted(utxos[node_id]))
+            del state.utxos[node_id][utxo_id]
+            del utxos[node_id][utxo_id]
+        elif operation < 0.9 and processed:
+            # * Adding a transaction that was already processed changes nothing
+            transaction_id = rnd.choice(sorted(processed))
+            state.processed_transactions.add(transaction_id)
+        else:
+            transaction_id = make_id(f'transaction {counter}')
+            state.processed_transactions.add(transaction_id)
+            processed.add(transaction_id)
+
+        check(state, utxos, processed, base_model)
+
+    # * A write to one state must never have leaked into another
+    for state, utxos, processed, base_model in states:
+        check(state, utxos, processed, base_model)
+
+def test_deleting_a_missing_utxo_raises_key_error():
+    state = State({node_id: {} for node_id in NODE_IDS}, [])
+    utxo = make_utxo('spent', '0', 1)
+    state.utxos['0'][utxo.id] = utxo
+
+    forked = state.fork()
+    del forked.utxos['0'][utxo.id]
+
+    with pytest.raises(KeyError):
+        del forked.utxos['0'][utxo.id]
+    with pytest.raises(KeyError):
+        forked.utxos['0'][utxo.id]
+    with pytest.raises(KeyError):
+        forked.utxos['3']
+
+    assert state.utxos['0'][utxo.id] is utxo
+
+def test_dictionary_round_trip():
+    state = State({node_id: {} for node_id in NODE_IDS}, ['genesis'])
+    for i in range(10):
+        utxo = make_utxo(i, NODE_IDS[i % len(NODE_IDS)], i)
+        state.utxos[NODE_IDS[i % len(NODE_IDS)]][utxo.id] = utxo
+        state = state.fork()
+    del state.utxos['0'][make_id(0)]
+
+    assert as_plain(State.from_dictionary(state.to_dict())) == as_plain(state)
@@ -0,0 +1,98 @@
+import base64
+import struct
+
+import pytest
+
+from noobcash import wire
+from noobcash.block import Block
+from noobcash.blockchain import Blockchain
+from noobcash.transaction import Transaction
+from noobcash.transaction_input import TransactionInput
+from noobcash.transaction_output import TransactionOutput
+
+from tests.test_state import make_id
+
+RING = {
+    '0': {'ip': '127.0.0.1', 'port': '5000', 'public_key': 'PK0'},
+    '1': {'ip': '127.0.0.1', 'port': '5001', 'public_key': 'PK1'},
+    # * Registered, but its key hasn't reached us yet
+    '2': {'ip': '127.0.0.1', 'port': '5002'},
+}
+
+RING_INDEX = {'PK0': '0', 'PK1': '1'}
+
+def make_transaction(seed, sender='PK0', recipient='PK1', amount=3.5, signed=True):
+    transaction_inputs = [TransactionInput(TransactionOutput(sender, value, make_id(f'{seed} parent {value}'))) for value in (2, 4)]
+    transaction = Transaction(sender, recipient, amount, transaction_inputs)
+    if signed:
+        transaction.signature = base64.b64encode(f'signature {seed}'.encode()).decode('utf-8')
+
+    return transaction
+
+def make_block(seed, previous_hash):
+    transactions = [make_transaction(f'{seed} {i}') for i in range(3)]
+    # * A key outside the ring is sent whole, and the genesis transaction has no signature
+    transactions.append(make_transaction(f'{seed} outsider', sender='PK9', signed=False))
+
+    return Block(previous_hash, f'2022-03-{seed:02} 12:00:00', make_id(f'block {seed}'), 2 ** 40 + seed, transactions)
+
+def test_transactions_round_trip():
+    transactions = [make_transaction(i) for i in range(5)] + [make_transaction('to outsider', recipient='PK9', amount=0)]
+
+    loaded = wire.loads(wire.TRANSACTIONS, wire.dumps(wire.TRANSACTIONS, transactions, RING_INDEX), RING)
+
+    assert [transaction.to_dict() for transaction in loaded] == [transaction.to_dict() for transaction in transactions]
+    assert wire.loads(wire.TRANSACTIONS, wire.dumps(wire.TRANSACTIONS, [], RING_INDEX), RING) == []
+
+def test_block_round_trip():
+    block = make_block(1, make_id('genesis'))
+
+    loaded = wire.loads(wire.BLOCK, wire.dumps(wire.BLOCK, block, RING_INDEX), RING)
+
+    assert loaded.to_dict() == block.to_dict()
+
+def test_blockchain_round_trip():
+    blocks = [make_block(1, make_id('genesis'))]
+    for seed in range(2, 5):
+        blocks.append(make_block(seed, blocks[-1].hash))
+    blockchain = Blockchain(blocks)
+
+    loaded = wire.loads(wire.BLOCKCHAIN, wire.dumps(wire.BLOCKCHAIN, blockchain, RING_INDEX), RING)
+
+    assert loaded.to_dict() == blockchain.to_dict()
+    assert loaded.get_height(blocks[2].hash) == 2
+
+    assert wire.loads(wire.BLOCKCHAIN, wire.dumps(wire.BLOCKCHAIN, Blockchain(), RING_INDEX), RING).to_dict() == Blockchain().to_dict()
+
+def test_every_truncated_payload_is_rejected():
+    data = wire.dumps(wire.BLOCK, make_block(1, make_id('genesis')), RING_INDEX)
+
+    for length in range(len(data)):
+        with pytest.raises(ValueError):
+            wire.loads(wire.BLOCK, data[:length], RING)
+
+def test_malformed_payloads_are_rejected():
+    data = wire.dumps(wire.TRANSACTIONS, [make_transaction(1)], RING_INDEX)
+
+    with pytest.raises(ValueError):
+        wire.loads(wire.TRANSACTIONS, data + b'\x00', RING)
+    with pytest.raises(ValueError):
+        wire.loads(wire.BLOCK, data, RING)
+    with pytest.raises(ValueError):
+        wire.loads(wire.TRANSACTIONS, struct.pack('!B', wire.FORMAT_VERSION + 1) + data[1:], RING)
+
+def test_addresses_must_resolve():
+    # * Node 2 has no key yet and node 7 is not in the ring at all
+    for ring_index in ({'PK0': '2'}, {'PK0': '7'}):
+        data = wire.dumps(wire.TRANSACTIONS, [make_transaction(1)], ring_index)
+        with pytest.raises(ValueError):
+            wire.loads(wire.TRANSACTIONS, data, RING)
+
+def test_invalid_transactions_are_rejected():
+    transaction = make_transaction(1)
+
+    # * Outputs worth more than the inputs, and a negative amount
+    for amount in (100, -1):
+        transaction.amount = amount
+        with pytest.raises(ValueError):
+            wire.loads(wire.TRANSACTIONS, wire.dumps(wire.TRANSACTIONS, [transaction], RING_INDEX), RING)